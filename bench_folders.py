@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for dropbox_folders.py.
+
+Usage:
+    python bench_folders.py suite [--dir /dev/shm] [--trees wide,deep,realistic,mixed] [--scale 1.0] [--dir-fds] [-o results.json]
+    python bench_folders.py overhead [-n 1000000]
+
+suite generates reproducible synthetic trees (on tmpfs by default, so the
+disk is not what gets measured) and times scan, CSV export and XLSX export
+separately, each tree in a fresh process so peak RSS is its own. Results are
+printed as JSON, to compare runs across versions.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import dropbox_folders as df
+
+
+def synthetic_folders(n: int, seed: int = 0) -> List[Tuple[int, str]]:
+    """(parent index, name) for n folders with a realistic mix of depth (up
+    to 16 levels) and fan-out; folder 0 is the root. Only names, nothing is
+    created on disk."""
+    rng = random.Random(seed)
+    folders = [(-1, "root")]
+    depths = [0]
+    cur = 0
+    for i in range(1, n):
+        if depths[cur] >= 16 or rng.random() < 0.35:
+            cur = rng.randrange(len(folders))
+        folders.append((cur, f"folder_{i % 997}_{rng.randrange(100)}"))
+        depths.append(depths[cur] + 1)
+        if rng.random() < 0.6:
+            cur = i
+    return folders
+
+
+# name -> (generator, folders at scale 1.0, whether it must be scanned with dir_fds)
+TREES = {}
+
+
+def tree_generator(name: str, folders: int, dir_fds: bool = False):
+    def register(fn):
+        TREES[name] = (fn, folders, dir_fds)
+        return fn
+    return register
+
+
+@tree_generator("wide", 100_000)
+def gen_wide(root: Path, n: int, rng: random.Random) -> int:
+    """One folder with n - 1 subfolders."""
+    root.mkdir()
+    for i in range(1, n):
+        os.mkdir(os.path.join(root, f"sibling_{i:06d}"))
+    return 0
+
+
+@tree_generator("deep", 5_000, dir_fds=True)
+def gen_deep(root: Path, n: int, rng: random.Random) -> int:
+    """A single chain n levels deep. Past a few hundred levels the full path
+    exceeds PATH_MAX, so each level is created relative to its parent's fd,
+    and the scan has to do the same (dir_fds) to get to the bottom."""
+    if os.mkdir not in os.supports_dir_fd:
+        raise OSError("the deep tree needs mkdir(dir_fd=...), which this platform lacks")
+    root.mkdir()
+    fd = os.open(root, os.O_RDONLY)
+    try:
+        for _ in range(1, n):
+            os.mkdir("level", dir_fd=fd)
+            child = os.open("level", os.O_RDONLY, dir_fd=fd)
+            os.close(fd)
+            fd = child
+    finally:
+        os.close(fd)
+    return 0
+
+
+WORDS = ("Projects", "Docs", "Archive", "2023", "2024", "Clients", "Invoices", "Photos", "Drafts", "Shared",
+         "Reports", "Assets", "Backup", "Old", "Final", "Review", "Exports", "Contracts", "Design", "Notes")
+
+
+def _power_law_tree(root: Path, n: int, rng: random.Random, files_per_folder: int = 0) -> int:
+    """n folders, breadth first, with Pareto-distributed fan-out (most folders
+    have a handful of subfolders or none, a few have hundreds), at most 20
+    levels deep, and names drawn from a small vocabulary as in real shares."""
+    root.mkdir()
+    queue = deque([(str(root), 0)])
+    made = 1
+    files = 0
+    while queue and made < n:
+        path, depth = queue.popleft()
+        for i in range(files_per_folder):
+            os.close(os.open(os.path.join(path, f"file_{i}.txt"), os.O_CREAT | os.O_WRONLY, 0o644))
+        files += files_per_folder
+        if depth >= 20 or (depth and rng.random() < 0.4):
+            continue
+        fan_out = min(int(rng.paretovariate(1.1)), 1000, n - made)
+        for i in range(fan_out):
+            child = os.path.join(path, f"{rng.choice(WORDS)}_{i}")
+            os.mkdir(child)
+            queue.append((child, depth + 1))
+        made += fan_out
+        if not queue and made < n:
+            queue.append((str(root), 0))
+    return files
+
+
+@tree_generator("realistic", 1_000_000)
+def gen_realistic(root: Path, n: int, rng: random.Random) -> int:
+    return _power_law_tree(root, n, rng)
+
+
+@tree_generator("mixed", 100_000)
+def gen_mixed(root: Path, n: int, rng: random.Random) -> int:
+    """Like realistic, with files in every folder for the scan to skip."""
+    return _power_law_tree(root, n, rng, files_per_folder=5)
+
+
+def remove_tree(root: Path) -> None:
+    """shutil.rmtree recurses once per level, which the deep tree is too deep
+    for (and its paths too long); this walks down with chdir instead."""
+    home = os.getcwd()
+    names: List[str] = []
+    os.chdir(root)
+    try:
+        while True:
+            sub = None
+            with os.scandir(".") as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub = entry.name
+                        break
+                    os.unlink(entry.name)
+            if sub is not None:
+                os.chdir(sub)
+                names.append(sub)
+            elif names:
+                os.chdir("..")
+                os.rmdir(names.pop())
+            else:
+                break
+    finally:
+        os.chdir(home)
+    os.rmdir(root)
+
+
+def peak_rss_mb() -> Optional[float]:
+    # ru_maxrss survives fork and exec on Linux, so a child would report the
+    # suite process's peak (it grows while generating trees); VmHWM is per
+    # address space and starts over at exec.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(tree_dir: Path, out_dir: Path, workers: int, dir_fds: bool = False) -> dict:
+    """Scan tree_dir, then export it; run in its own process (see suite).
+    Peak RSS is the process peak after each phase, so it only grows.
+
+    A generated tree is fully readable, so any skip means the scan did not
+    cover it and the numbers would be meaningless: that raises instead."""
+    phases = {}
+
+    def phase(name: str, started: float, folders: int) -> None:
+        elapsed = time.perf_counter() - started
+        phases[name] = {"seconds": round(elapsed, 3), "folders_per_sec": round(folders / elapsed) if elapsed else None,
+                        "peak_rss_mb": peak_rss_mb()}
+
+    started = time.perf_counter()
+    tree, skipped = df.scan_folders(tree_dir, False, {"cancel": False}, workers=workers, dir_fds=dir_fds)
+    phase("scan", started, len(tree))
+    if skipped:
+        path, reason = skipped[0]
+        raise RuntimeError(f"{len(skipped)} folder(s) skipped in a generated tree, e.g. {path}: {reason}")
+    csv_path = out_dir / "bench.csv"
+    started = time.perf_counter()
+    df.write_csv(tree, csv_path)
+    phase("csv", started, len(tree))
+    xlsx_path = out_dir / "bench.xlsx"
+    started = time.perf_counter()
+    df.write_excel(tree, xlsx_path)
+    phase("xlsx", started, len(tree))
+    sizes = {"csv_bytes": csv_path.stat().st_size, "xlsx_bytes": xlsx_path.stat().st_size}
+    csv_path.unlink()
+    xlsx_path.unlink()
+    return {"folders": len(tree), "max_levels": tree.max_levels, "dir_fds": dir_fds, "phases": phases, **sizes}
+
+
+def bench_suite(base: Path, trees: List[str], scale: float, workers: int, seed: int, keep: bool, dir_fds: bool = False) -> dict:
+    work = base / "dropbox_folders_bench"
+    work.mkdir(parents=True, exist_ok=True)
+    results = []
+    for name in trees:
+        generate, folders, needs_dir_fds = TREES[name]
+        n = max(2, int(folders * scale))
+        root = work / f"{name}_{n}_{seed}"
+        marker = work / f"{root.name}.done"
+        # Trees kept by an earlier --keep run are reused as they are
+        generated = None
+        if not marker.exists():
+            if root.exists():
+                remove_tree(root)
+            started = time.perf_counter()
+            files = generate(root, n, random.Random(seed))
+            generated = round(time.perf_counter() - started, 3)
+            marker.write_text(json.dumps({"files": files}))
+        files = json.loads(marker.read_text())["files"]
+        command = [sys.executable, os.path.abspath(__file__), "_measure", str(root), str(work), str(workers)]
+        if dir_fds or needs_dir_fds:
+            command.append("--dir-fds")
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode:
+            raise RuntimeError(f"measuring {name} failed:\n{proc.stderr}")
+        result = {"tree": name, "files": files, "generate_seconds": generated}
+        result.update(json.loads(proc.stdout))
+        results.append(result)
+        if not keep:
+            remove_tree(root)
+            marker.unlink()
+    if not keep and not any(work.iterdir()):
+        work.rmdir()
+    return {"benchmark": "suite", "python": sys.version.split()[0], "platform": sys.platform, "scale": scale,
+            "workers": workers, "dir_fds": dir_fds, "seed": seed, "results": results}
+
+
+def bench_overhead(n: int) -> dict:
+    """Per-folder path handling in the traversal loop, without any I/O: what
+    the walk did before (Path(entry.path), then to_long_path and str() again
+    for scandir) against what it does now (plain strings, prefix only on the
+    root)."""
+    folders = synthetic_folders(n)
+    root = str(Path(os.sep, "bench", "root"))
+    paths = [root] + [""] * (n - 1)
+    for i in range(1, n):
+        parent, name = folders[i]
+        paths[i] = os.path.join(paths[parent], name)
+
+    def before() -> None:
+        for i in range(1, n):
+            parent, name = folders[i]
+            dir_path = Path(os.path.join(paths[parent], name))
+            str(df.to_long_path(dir_path, True))
+
+    def after() -> None:
+        for i in range(1, n):
+            parent, name = folders[i]
+            os.path.join(paths[parent], name)
+
+    results = {}
+    for label, fn in (("before", before), ("after", after)):
+        best = None
+        for _ in range(3):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = {"seconds": round(best, 4), "ns_per_folder": round(best / (n - 1) * 1e9, 1)}
+    results["saved_ns_per_folder"] = round(results["before"]["ns_per_folder"] - results["after"]["ns_per_folder"], 1)
+    return {"benchmark": "overhead", "folders": n, "python": sys.version.split()[0], "platform": sys.platform, **results}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for dropbox_folders.py; results are printed as JSON.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("suite", help="generate synthetic trees and time scan, CSV and XLSX export")
+    p.add_argument("--dir", default="/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                   help="where to generate the trees (default: /dev/shm if present, else the temp dir)")
+    p.add_argument("--trees", default=",".join(TREES), help=f"comma-separated subset of {', '.join(TREES)}")
+    p.add_argument("--scale", type=float, default=1.0, help="multiply every tree's folder count (e.g. 0.1 for a quick run)")
+    p.add_argument("-w", "--workers", type=int, default=1, help="scan threads (default: 1)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--keep", action="store_true", help="keep the generated trees for the next run")
+    p.add_argument("--dir-fds", action="store_true",
+                   help="scan every tree with dir_fds (openat); the deep tree always is, it is deeper than PATH_MAX")
+    p.add_argument("-o", "--output", help="also write the JSON here")
+    p = sub.add_parser("overhead", help="per-folder path handling cost in the traversal loop (no I/O)")
+    p.add_argument("-n", "--folders", type=int, default=1_000_000)
+    p = sub.add_parser("_measure")
+    p.add_argument("tree_dir")
+    p.add_argument("out_dir")
+    p.add_argument("workers", type=int)
+    p.add_argument("--dir-fds", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "_measure":
+        print(json.dumps(measure(Path(args.tree_dir), Path(args.out_dir), args.workers, args.dir_fds)))
+        return 0
+    if args.command == "suite":
+        unknown = set(args.trees.split(",")) - set(TREES)
+        if unknown:
+            parser.error(f"unknown trees: {', '.join(sorted(unknown))}")
+        result = bench_suite(Path(args.dir), args.trees.split(","), args.scale, args.workers, args.seed, args.keep,
+                             args.dir_fds)
+    else:
+        result = bench_overhead(args.folders)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if getattr(args, "output", None):
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,118 +13,1095 @@ import os
 import sys
 import csv
 import time
+import queue
+import threading
+import re
+import gzip
+import json
+import base64
 import errno
-import subprocess
+import io
+import bisect
+import heapq
 from pathlib import Path
-from typing import List, Tuple
+from collections import deque
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-# GUI imports
-try:
-    import tkinter as tk
-    from tkinter import filedialog, messagebox
-except Exception as e:
-    print("tkinter is required for the GUI. Install it or run on a system with tkinter available.", file=sys.stderr)
-    raise
+# tkinter, openpyxl, zipfile, concurrent.futures and tracemalloc are imported where they are
+# used, so headless runs (see cli_main) start fast and work without a display.
 
 IS_WINDOWS = (os.name == "nt")
 
-# Track whether we already attempted an install to avoid loops
-_ALREADY_TRIED_INSTALL = os.environ.get("OPENPYXL_INSTALL_ATTEMPTED") == "1"
+# Directory listings are I/O bound (scandir releases the GIL), so use more
+# threads than cores; on network/sync-client mounts latency dominates.
+DEFAULT_SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-# Try to import openpyxl; if missing, attempt install and self-restart exactly once
-HAVE_OPENPYXL = False
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    from openpyxl.utils import get_column_letter
-    HAVE_OPENPYXL = True
-except ImportError:
-    if not _ALREADY_TRIED_INSTALL:
-        try:
-            print("openpyxl not found. Installing...")
-            subprocess.check_check_call  # force NameError if older python
-        except Exception:
-            pass
-        try:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "openpyxl"])
-            env = dict(os.environ)
-            env["OPENPYXL_INSTALL_ATTEMPTED"] = "1"
-            print("openpyxl installed. Restarting script...")
-            os.execve(sys.executable, [sys.executable] + sys.argv, env)
-        except Exception as e:
-            print("Failed to install openpyxl:", e)
-            HAVE_OPENPYXL = False
+# Walk with directory fds (open each folder relative to its parent's fd)
+# where the platform supports it; Windows has no openat.
+DIR_FD_SUPPORTED = not IS_WINDOWS and os.open in os.supports_dir_fd and os.scandir in os.supports_fd
+# Directory fds held open at once by one scan
+DIR_FD_LIMIT = 128
+
+# Excel's hard limit is 1,048,576 rows per sheet, one of which is the header
+EXCEL_MAX_DATA_ROWS = 1048575
+
+class FolderTree:
+    """Compact folder tree: one parent index, depth and interned name per node.
+
+    Nodes are stored in output order (node 0 is the scan root). Level lists
+    ("rows") are only materialized on demand, so memory is O(nodes) instead of
+    O(sum of depths). level_widths (longest name per level) is kept up to date
+    as nodes are added, so writers can size columns without a pass over the rows.
+
+    With with_meta, each node also carries the directory's mtime (ns), device
+    and inode (-1 until known), which is what snapshots and incremental rescans
+    use. Inode numbers are only unique per device, so a folder is identified
+    by the (device, inode) pair (see file_id).
+    """
+
+    def __init__(self, root_name: str, with_meta: bool = False):
+        self.names: List[str] = [sys.intern(root_name)]
+        self.parents = array("i", [-1])
+        self.depths = array("i", [0])
+        self.level_widths: List[int] = [len(root_name)]
+        self.mtimes = array("q", [-1]) if with_meta else None
+        self.devs = array("q", [-1]) if with_meta else None
+        self.inodes = array("q", [-1]) if with_meta else None
+        # When the scan that built this tree started; see unchanged()
+        self.scanned_at_ns = 0
+        # Directories whose children were taken from a previous snapshot
+        self.reused_dirs = 0
+        # Set by FolderWatcher: nodes whose child list is known to be current
+        # (watched, no events since), so a rescan reuses it without a stat
+        self.clean: Optional[bytearray] = None
+        self._child_start = None
+        self._child_ids = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def max_levels(self) -> int:
+        return len(self.level_widths)
+
+    def add(self, parent: int, name: str) -> int:
+        depth = self.depths[parent] + 1
+        self.names.append(sys.intern(name))
+        self.parents.append(parent)
+        self.depths.append(depth)
+        widths = self.level_widths
+        if depth == len(widths):
+            widths.append(len(name))
+        elif len(name) > widths[depth]:
+            widths[depth] = len(name)
+        if self.mtimes is not None:
+            self.mtimes.append(-1)
+            self.devs.append(-1)
+            self.inodes.append(-1)
+        return len(self.names) - 1
+
+    def set_meta(self, node: int, mtime_ns: int, dev: int, inode: int) -> None:
+        self.mtimes[node] = mtime_ns
+        self.devs[node] = dev
+        self.inodes[node] = inode
+
+    def file_id(self, node: int) -> Optional[Tuple[int, int]]:
+        """(device, inode) of node's directory, or None where it is unknown."""
+        ino = self.inodes[node]
+        return (self.devs[node], ino) if ino > 0 else None
+
+    def index_children(self) -> None:
+        """Build the child index (CSR layout: a start offset per node into one
+        flat id array) used by children(). Call once the tree is complete."""
+        n = len(self.names)
+        counts = array("i", bytes(4 * (n + 1)))
+        parents = self.parents
+        for node in range(1, n):
+            counts[parents[node] + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        fill = array("i", counts)
+        ids = array("i", bytes(4 * max(n - 1, 0)))
+        for node in range(1, n):
+            p = parents[node]
+            ids[fill[p]] = node
+            fill[p] += 1
+        self._child_start, self._child_ids = counts, ids
+
+    def children(self, node: int) -> "array":
+        if self._child_start is None:
+            self.index_children()
+        return self._child_ids[self._child_start[node]:self._child_start[node + 1]]
+
+    def renumber(self, order: "array") -> None:
+        """Rearrange the nodes in place so that node order[i] becomes node i.
+        order lists every node once, each after its parent (see _walk_order)."""
+        self._child_start = self._child_ids = None
+        new_ids = array("i", bytes(4 * len(self.names)))
+        for new, old in enumerate(order):
+            new_ids[old] = new
+        names, parents, depths = self.names, self.parents, self.depths
+        self.names = [names[old] for old in order]
+        self.parents = array("i", (new_ids[parents[old]] if old else -1 for old in order))
+        self.depths = array("i", (depths[old] for old in order))
+        if self.mtimes is not None:
+            mtimes, devs, inodes = self.mtimes, self.devs, self.inodes
+            self.mtimes = array("q", (mtimes[old] for old in order))
+            self.devs = array("q", (devs[old] for old in order))
+            self.inodes = array("q", (inodes[old] for old in order))
+        self.clean = None
+
+    def unchanged(self, node: int, mtime_ns: int, dev: int, inode: int) -> bool:
+        """True if node's directory still has this mtime, device and inode, and
+        that mtime is comfortably older than the scan (coarse timestamps on
+        FAT/SMB mean a change in the same tick as the scan could otherwise go
+        unnoticed)."""
+        return (self.mtimes[node] == mtime_ns and self.inodes[node] == inode and self.devs[node] == dev
+                and mtime_ns < self.scanned_at_ns - 2_000_000_000)
+
+    def row(self, node: int) -> List[str]:
+        parts = []
+        while node >= 0:
+            parts.append(self.names[node])
+            node = self.parents[node]
+        parts.reverse()
+        return parts
+
+    def tail(self, node: int, n: int = 4) -> str:
+        parts = []
+        while node >= 0 and len(parts) < n:
+            parts.append(self.names[node])
+            node = self.parents[node]
+        return "/".join(reversed(parts))
+
+    def __iter__(self) -> Iterator[List[str]]:
+        # Keep the current root-to-node path and only rebuild it when the next
+        # node is not a child of something on it (never, for DFS order).
+        ids: List[int] = []
+        row: List[str] = []
+        names, parents, depths = self.names, self.parents, self.depths
+        for node in range(len(names)):
+            depth = depths[node]
+            if depth <= len(ids) and (depth == 0 or ids[depth - 1] == parents[node]):
+                del ids[depth:]
+                del row[depth:]
+            else:
+                ids = []
+                p = parents[node]
+                while p >= 0:
+                    ids.append(p)
+                    p = parents[p]
+                ids.reverse()
+                row = [names[i] for i in ids]
+            ids.append(node)
+            row.append(names[node])
+            yield row[:]
+
+
+def _walk_order(tree: FolderTree, depth_first: bool = True, skips: Optional[Dict[int, List[Tuple[int, str, str]]]] = None, skipped: Optional[List[Tuple[str, str]]] = None) -> "array":
+    """Node ids of tree in DFS or BFS order from the root, siblings in id
+    (i.e. listing) order. Feed it to FolderTree.renumber.
+
+    skips maps a node to the (position, path, reason) skips met while listing
+    it, position being the number of its subfolders listed before the skip;
+    they are appended to skipped in the order a sequential walk meets them.
+    """
+    order = array("i", [0])
+    work = deque()
+
+    def queue(node: int) -> None:
+        items = tree.children(node)
+        records = skips.get(node) if skips else None
+        if records:
+            children, items, start = items, [], 0
+            for position, path, reason in records:
+                items.extend(children[start:position])
+                items.append((path, reason))
+                start = position
+            items.extend(children[start:])
+        work.extend(reversed(items) if depth_first else items)
+
+    queue(0)
+    pop = work.pop if depth_first else work.popleft
+    while work:
+        item = pop()
+        if isinstance(item, tuple):
+            skipped.append(item)
+            continue
+        order.append(item)
+        queue(item)
+    return order
+
+
+def _check_rows(rows: Sequence[List[str]]) -> None:
+    """The writers go over rows more than once (column widths, then the rows),
+    so a generator would silently come out empty."""
+    if iter(rows) is rows:
+        raise TypeError("rows must be a FolderTree or a list of rows, not a one-shot iterator")
+
+
+def _max_levels(rows: Sequence[List[str]]) -> int:
+    if isinstance(rows, FolderTree):
+        return rows.max_levels
+    return max(len(r) for r in rows) if rows else 1
+
+
+def _level_widths(rows: Sequence[List[str]]) -> List[int]:
+    """Longest name per level (column)."""
+    if isinstance(rows, FolderTree):
+        return rows.level_widths
+    widths: List[int] = []
+    for r in rows:
+        for i, name in enumerate(r):
+            if i == len(widths):
+                widths.append(len(name))
+            elif len(name) > widths[i]:
+                widths[i] = len(name)
+    return widths
+
+
+def _top_level_runs(rows: Sequence[List[str]]) -> List[int]:
+    """Lengths of the runs of consecutive rows that share a top-level folder (Level2)."""
+    if isinstance(rows, FolderTree):
+        # Parents always come before their children, so one forward pass finds
+        # every node's top-level ancestor (the root row gets its own key, -1).
+        parents = rows.parents
+        keys = array("i", [-1])
+        for node in range(1, len(rows)):
+            p = parents[node]
+            keys.append(node if p == 0 else keys[p])
     else:
-        HAVE_OPENPYXL = False
+        keys = [r[1] if len(r) > 1 else None for r in rows]
+    runs: List[int] = []
+    prev = object()
+    for key in keys:
+        if runs and key == prev:
+            runs[-1] += 1
+        else:
+            runs.append(1)
+            prev = key
+    return runs
+
+
+def _split_sheets(rows: Sequence[List[str]], max_rows_per_sheet: int, split_by_top_level: bool) -> Iterator[Tuple[bool, List[str]]]:
+    """Yield (starts_new_sheet, row) for every row.
+
+    A new sheet is started when the current one is full, or with
+    split_by_top_level, early rather than cut a top-level folder's subtree in
+    two (unless that subtree alone is bigger than a sheet).
+    """
+    runs = iter(_top_level_runs(rows)) if split_by_top_level else None
+    run_left = 0
+    n_rows = 0
+    for row in rows:
+        new_sheet = n_rows == max_rows_per_sheet
+        if runs is not None:
+            if run_left == 0:
+                run_left = next(runs)
+                # A run longer than a sheet is split anyway, so it just follows on
+                if n_rows and n_rows + run_left > max_rows_per_sheet and run_left <= max_rows_per_sheet:
+                    new_sheet = True
+            run_left -= 1
+        if new_sheet:
+            n_rows = 0
+        n_rows += 1
+        yield new_sheet, row
+
+
+def _sheet_title(index: int) -> str:
+    return "Folders" if index == 0 else f"Folders_{index + 1}"
+
+
+def write_excel(rows: Sequence[List[str]], out_path: Path, max_rows_per_sheet: int = EXCEL_MAX_DATA_ROWS, split_by_top_level: bool = False, engine: str = "native", on_phase: Optional[Callable[[str], None]] = None) -> None:
+    """Write rows to .xlsx, rolling over to Folders_2, Folders_3, ... sheets when
+    a sheet reaches max_rows_per_sheet (see _split_sheets for split_by_top_level).
+    rows is a FolderTree or a list of Level rows (it is read more than once).
+
+    engine "native" is the built-in streaming writer and needs no third-party
+    packages; "openpyxl" writes the same layout through openpyxl.
+
+    on_phase, if given, is called with "widths" after the column-width pass and
+    with "sheets" once every row is in the workbook, before the rest is saved
+    (MemoryProfiler.phase fits).
+    """
+    _check_rows(rows)
+    if engine == "native":
+        _write_excel_native(rows, out_path, max_rows_per_sheet, split_by_top_level, on_phase)
+    elif engine == "openpyxl":
+        _write_excel_openpyxl(rows, out_path, max_rows_per_sheet, split_by_top_level, on_phase)
+    else:
+        raise ValueError(f"engine must be 'native' or 'openpyxl', not {engine!r}")
+
+
+def _column_width(header: str, widths: List[int], c: int) -> int:
+    max_len = max(len(header), widths[c - 1] if c <= len(widths) else 0)
+    return max(12, min(60, max_len + 2))
+
+
+def _column_letter(c: int) -> str:
+    letters = ""
+    while c:
+        c, rem = divmod(c - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+# Characters XML 1.0 cannot carry, plus a literal "_" that would otherwise be
+# read back as the start of an _xHHHH_ escape. Both use the OOXML escape form.
+_XLSX_ESCAPE_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]|_(?=x[0-9A-Fa-f]{4}_)")
+
+
+def _xlsx_text(value: str) -> str:
+    value = _XLSX_ESCAPE_RE.sub(lambda m: f"_x{ord(m.group()):04X}_", value)
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
 
+_XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
 
-def write_excel(rows: List[List[str]], out_path: Path) -> None:
+# Style indexes (cellXfs) used by the native writer: 1 = header, 2 = data cell.
+# Both are left/center aligned with a thin light-grey border; the header is
+# also bold on a light-grey fill, matching the openpyxl output.
+_XLSX_STYLES = _XML_DECL + f"""<styleSheet xmlns="{_XLSX_NS}">\
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font>\
+<font><b/><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>\
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>\
+<fill><patternFill patternType="solid"><fgColor rgb="FFF2F2F2"/><bgColor rgb="FFF2F2F2"/></patternFill></fill></fills>\
+<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>\
+<border><left style="thin"><color rgb="FFCCCCCC"/></left><right style="thin"><color rgb="FFCCCCCC"/></right>\
+<top style="thin"><color rgb="FFCCCCCC"/></top><bottom style="thin"><color rgb="FFCCCCCC"/></bottom><diagonal/></border></borders>\
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>\
+<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>\
+<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">\
+<alignment horizontal="left" vertical="center"/></xf>\
+<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" applyAlignment="1">\
+<alignment horizontal="left" vertical="center"/></xf></cellXfs>\
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>\
+</styleSheet>"""
+
+
+# Sheet XML buffered before it is written to the zip
+XLSX_FLUSH_CHARS = 1 << 20
+
+
+def _write_excel_native(rows: Sequence[List[str]], out_path: Path, max_rows_per_sheet: int, split_by_top_level: bool, on_phase: Optional[Callable[[str], None]] = None) -> None:
+    """Minimal SpreadsheetML writer: zipfile plus sheet XML streamed in chunks.
+
+    Every value goes through the shared-strings table. Folder names repeat a lot
+    across Level columns, so each distinct name is stored once and the sheets
+    only hold small integer references.
+    """
+    import zipfile
+
+    widths = _level_widths(rows)
+    if on_phase is not None:
+        on_phase("widths")
+    max_levels = max(len(widths), 1)
+    cols = [f"Level{i}" for i in range(1, max_levels + 1)]
+    letters = [_column_letter(c) for c in range(1, max_levels + 1)]
+
+    strings: Dict[str, int] = {}
+    sheet_rows: List[int] = []
+
+    cols_xml = "".join(
+        f'<col min="{c}" max="{c}" width="{_column_width(h, widths, c)}" customWidth="1"/>'
+        for c, h in enumerate(cols, 1))
+    sheet_top = (_XML_DECL + f'<worksheet xmlns="{_XLSX_NS}" xmlns:r="{_XLSX_REL_NS}">'
+                 '<sheetViews><sheetView workbookViewId="0">'
+                 '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                 '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/>'
+                 '</sheetView></sheetViews><sheetFormatPr defaultRowHeight="15"/>'
+                 f'<cols>{cols_xml}</cols><sheetData>')
+
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        out = None
+        buf: List[str] = []
+        buffered = 0
+
+        def start_sheet():
+            nonlocal out
+            sheet_rows.append(0)
+            out = zf.open(f"xl/worksheets/sheet{len(sheet_rows)}.xml", "w", force_zip64=True)
+            out.write(sheet_top.encode("utf-8"))
+            header = "".join(f'<c r="{letters[i]}1" s="1" t="s"><v>{strings.setdefault(h, len(strings))}</v></c>'
+                             for i, h in enumerate(cols))
+            buf.append(f'<row r="1">{header}</row>')
+
+        def flush() -> None:
+            nonlocal buffered
+            out.write("".join(buf).encode("utf-8", "replace"))
+            buf.clear()
+            buffered = 0
+
+        def finish_sheet() -> None:
+            n_rows = sheet_rows[-1]
+            buf.append(f'</sheetData><autoFilter ref="A1:{letters[-1]}{1 + n_rows}"/></worksheet>')
+            flush()
+            out.close()
+
+        start_sheet()
+        for new_sheet, row in _split_sheets(rows, max_rows_per_sheet, split_by_top_level):
+            if new_sheet:
+                finish_sheet()
+                start_sheet()
+            r = sheet_rows[-1] + 2
+            sheet_rows[-1] += 1
+            n = len(row)
+            cells = []
+            for i, letter in enumerate(letters):
+                if i < n:
+                    idx = strings.get(row[i])
+                    if idx is None:
+                        idx = strings[row[i]] = len(strings)
+                    cells.append(f'<c r="{letter}{r}" s="2" t="s"><v>{idx}</v></c>')
+                else:
+                    cells.append(f'<c r="{letter}{r}" s="2"/>')
+            row_xml = f'<row r="{r}">{"".join(cells)}</row>'
+            buf.append(row_xml)
+            # By size, not row count: a row of a very deep tree has thousands of cells
+            buffered += len(row_xml)
+            if buffered >= XLSX_FLUSH_CHARS:
+                flush()
+        finish_sheet()
+        if on_phase is not None:
+            on_phase("sheets")
+
+        with zf.open("xl/sharedStrings.xml", "w", force_zip64=True) as f:
+            f.write((_XML_DECL + f'<sst xmlns="{_XLSX_NS}" count="{len(strings)}" uniqueCount="{len(strings)}">').encode("utf-8"))
+            chunk = []
+            for value in strings:
+                text = _xlsx_text(value)
+                if text != text.strip():
+                    chunk.append(f'<si><t xml:space="preserve">{text}</t></si>')
+                else:
+                    chunk.append(f"<si><t>{text}</t></si>")
+                if len(chunk) >= 1000:
+                    f.write("".join(chunk).encode("utf-8", "replace"))
+                    chunk.clear()
+            chunk.append("</sst>")
+            f.write("".join(chunk).encode("utf-8", "replace"))
+
+        n_sheets = len(sheet_rows)
+        sheets_xml = "".join(f'<sheet name="{_sheet_title(i)}" sheetId="{i + 1}" r:id="rId{i + 1}"/>' for i in range(n_sheets))
+        filters_xml = "".join(
+            f'<definedName name="_xlnm._FilterDatabase" localSheetId="{i}" hidden="1">'
+            f"'{_sheet_title(i)}'!$A$1:${letters[-1]}${1 + n}</definedName>"
+            for i, n in enumerate(sheet_rows))
+        zf.writestr("xl/workbook.xml", _XML_DECL + f'<workbook xmlns="{_XLSX_NS}" xmlns:r="{_XLSX_REL_NS}">'
+                    f"<sheets>{sheets_xml}</sheets><definedNames>{filters_xml}</definedNames></workbook>")
+        zf.writestr("xl/styles.xml", _XLSX_STYLES)
+        wb_rels = "".join(
+            f'<Relationship Id="rId{i + 1}" Type="{_XLSX_REL_NS}/worksheet" Target="worksheets/sheet{i + 1}.xml"/>'
+            for i in range(n_sheets))
+        wb_rels += (f'<Relationship Id="rId{n_sheets + 1}" Type="{_XLSX_REL_NS}/styles" Target="styles.xml"/>'
+                    f'<Relationship Id="rId{n_sheets + 2}" Type="{_XLSX_REL_NS}/sharedStrings" Target="sharedStrings.xml"/>')
+        zf.writestr("xl/_rels/workbook.xml.rels", _XML_DECL + f'<Relationships xmlns="{_XLSX_PKG_REL_NS}">{wb_rels}</Relationships>')
+        zf.writestr("_rels/.rels", _XML_DECL + f'<Relationships xmlns="{_XLSX_PKG_REL_NS}">'
+                    f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        overrides = "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i + 1}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(n_sheets))
+        zf.writestr("[Content_Types].xml", _XML_DECL +
+                    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                    '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+                    f"{overrides}</Types>")
+
+
+def _write_excel_openpyxl(rows: Sequence[List[str]], out_path: Path, max_rows_per_sheet: int, split_by_top_level: bool, on_phase: Optional[Callable[[str], None]] = None) -> None:
     from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
     from openpyxl.utils import get_column_letter
 
-    max_levels = max(len(r) for r in rows) if rows else 1
+    widths = _level_widths(rows)
+    if on_phase is not None:
+        on_phase("widths")
+    max_levels = max(len(widths), 1)
     cols = [f"Level{i}" for i in range(1, max_levels + 1)]
-    norm_rows = [r + [""] * (max_levels - len(r)) for r in rows]
+    last_col = get_column_letter(len(cols))
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Folders"
+    # Write-only workbook: rows are serialized straight into the sheet XML as
+    # they are appended, so memory stays flat. The catch is that column widths
+    # and styles have to be known before the first row of each sheet.
+    wb = Workbook(write_only=True)
 
-    header_font = Font(bold=True)
-    fill = PatternFill(start_color="FFF2F2F2", end_color="FFF2F2F2", fill_type="solid")
     left = Alignment(horizontal="left", vertical="center")
     thin = Side(style="thin", color="FFCCCCCC")
     border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    fill = PatternFill(start_color="FFF2F2F2", end_color="FFF2F2F2", fill_type="solid")
+    wb.add_named_style(NamedStyle(name="Folder header", font=Font(bold=True), fill=fill, alignment=left, border=border))
+    wb.add_named_style(NamedStyle(name="Folder cell", alignment=left, border=border))
+
+    sheets = []
 
-    ws.append(cols)
-    for c in range(1, len(cols) + 1):
-        cell = ws.cell(row=1, column=c)
-        cell.font = header_font
-        cell.fill = fill
-        cell.alignment = left
-        cell.border = border
+    def start_sheet():
+        ws = wb.create_sheet(_sheet_title(len(sheets)))
+        sheets.append(ws)
+        for c, header in enumerate(cols, 1):
+            ws.column_dimensions[get_column_letter(c)].width = _column_width(header, widths, c)
+        ws.freeze_panes = "A2"
 
-    for row in norm_rows:
-        ws.append(row)
+        header_cells = []
+        for header in cols:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.style = "Folder header"
+            header_cells.append(cell)
+        ws.append(header_cells)
 
-    for r in range(2, 2 + len(norm_rows)):
-        for c in range(1, len(cols) + 1):
-            cell = ws.cell(row=r, column=c)
-            cell.alignment = left
-            cell.border = border
+        # One styled cell per column, refilled for every row. append() writes
+        # the row out before returning, so reusing the cells is safe and avoids
+        # creating and styling a new cell object per value.
+        cells = [WriteOnlyCell(ws) for _ in cols]
+        for cell in cells:
+            cell.style = "Folder cell"
+        return ws, cells
 
-    ws.freeze_panes = "A2"
-    ws.auto_filter.ref = f"A1:{get_column_letter(len(cols))}{1 + len(norm_rows)}"
+    def finish_sheet(ws, n_rows: int) -> None:
+        ws.auto_filter.ref = f"A1:{last_col}{1 + n_rows}"
 
-    for c in range(1, len(cols) + 1):
-        col_letter = get_column_letter(c)
-        max_len = max(len(str(ws.cell(row=r, column=c).value or "")) for r in range(1, len(norm_rows) + 2))
-        ws.column_dimensions[col_letter].width = max(12, min(60, max_len + 2))
+    ws, cells = start_sheet()
+    n_rows = 0
+    for new_sheet, row in _split_sheets(rows, max_rows_per_sheet, split_by_top_level):
+        if new_sheet:
+            finish_sheet(ws, n_rows)
+            ws, cells = start_sheet()
+            n_rows = 0
+        n = len(row)
+        for i, cell in enumerate(cells):
+            cell.value = row[i] if i < n else None
+        ws.append(cells)
+        n_rows += 1
+    finish_sheet(ws, n_rows)
+    if on_phase is not None:
+        on_phase("sheets")
 
     wb.save(out_path.as_posix())
 
 
-def write_csv(rows: List[List[str]], out_path: Path) -> None:
-    max_levels = max(len(r) for r in rows) if rows else 1
+# Text outputs (CSV, JSON Lines) named e.g. folders.csv.gz are compressed
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".xz": "xz", ".zst": "zstd"}
+
+
+def _compression(out_path: Path) -> Optional[str]:
+    return COMPRESSION_SUFFIXES.get(out_path.suffix.lower())
+
+
+class _CompressingWriter(io.RawIOBase):
+    """Binary file that compresses on a background thread.
+
+    write() only queues the data; the thread runs the compressor (zlib, lzma
+    and zstandard all release the GIL) and writes the result, so compression
+    overlaps with whatever produces the data (the scan, for streamed output). The bounded queue keeps memory flat if the
+    compressor falls behind.
+    """
+
+    def __init__(self, out_path: Path, compressor):
+        super().__init__()
+        self._f = out_path.open("wb")
+        self._compressor = compressor
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=16)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="compress-output", daemon=True)
+        self._thread.start()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def _run(self) -> None:
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error is None:
+                try:
+                    self._f.write(self._compressor.compress(chunk))
+                except BaseException as e:
+                    self._error = e
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self._error is None:
+                self._f.write(self._compressor.flush())
+        finally:
+            self._f.close()
+            super().close()
+        if self._error is not None:
+            raise self._error
+
+
+def _open_text_output(out_path: Path, newline: str):
+    """out_path opened for writing UTF-8 text, compressed per its suffix. A
+    name that is not valid UTF-8 (lone surrogates, possible on Linux) is
+    written with backslash escapes rather than failing the export."""
+    method = _compression(out_path)
+    if method is None:
+        return out_path.open("w", newline=newline, encoding="utf-8", errors="backslashreplace")
+    if method == "gzip":
+        import zlib
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    elif method == "xz":
+        import lzma
+        compressor = lzma.LZMACompressor(preset=3)
+    else:
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    return _open_compressed_text(out_path, newline, compressor)
+
+
+def _open_compressed_text(out_path: Path, newline: str, compressor):
+    raw = io.BufferedWriter(_CompressingWriter(out_path, compressor), buffer_size=256 * 1024)
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="backslashreplace", newline=newline)
+
+
+def write_csv(rows: Sequence[List[str]], out_path: Path) -> None:
+    _check_rows(rows)
+    max_levels = _max_levels(rows)
     cols = [f"Level{i}" for i in range(1, max_levels + 1)]
-    norm_rows = [r + [""] * (max_levels - len(r)) for r in rows]
 
-    with out_path.open("w", newline="", encoding="utf-8") as f:
+    with _open_text_output(out_path, "") as f:
         writer = csv.writer(f)
         writer.writerow(cols)
-        writer.writerows(norm_rows)
+        writer.writerows(r + [""] * (max_levels - len(r)) for r in rows)
+
+
+class ScanObserver:
+    """Subscriber for scan events; override the callbacks you need.
+
+    on_progress gets the folder count so far, the tail of the latest path and
+    the folders/sec rate since the previous call. It is rate limited (about one
+    call per PROGRESS_INTERVAL seconds) and always runs on the thread that
+    called scan_folders. on_skip is called for every skipped path as it is
+    found; on_finish once, when the scan ends.
+
+    on_skip_detail is the same event with the error behind it; override it
+    instead of on_skip to get those (the default just calls on_skip).
+    """
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        pass
+
+    def on_skip(self, path: str, reason: str) -> None:
+        pass
+
+    def on_skip_detail(self, path: str, reason: str, category: str, errno_code: Optional[int], winerror: Optional[int], depth: int) -> None:
+        """category is one of SKIP_CATEGORIES; errno_code and winerror come from
+        the OSError (None where unset); depth is the skipped folder's level
+        (the root is 0)."""
+        self.on_skip(path, reason)
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        pass
+
+
+class CsvStreamWriter:
+    """Write CSV rows while the scan runs instead of after it.
+
+    Rows go unpadded to "<out>.part" as folders are found, so a killed run
+    still leaves its partial output on disk and nothing is held in memory.
+    Folders arrive in discovery order (with workers > 1, or after retries),
+    so close(tree) writes the final file from the finished tree, in its
+    DFS/BFS order, with the LevelN header and padding (compressed if out_path
+    ends in .gz, .xz or .zst) and removes the part file. That one is then
+    gzipped too, at level 1 on a background thread while the scan runs, so
+    it costs little extra disk I/O.
+    """
+
+    def __init__(self, out_path: Path):
+        self.out_path = out_path
+        self.part_path = out_path.with_name(out_path.name + ".part")
+        if _compression(out_path) is not None:
+            import zlib
+            self._f = _open_compressed_text(self.part_path, "", zlib.compressobj(1, zlib.DEFLATED, 31))
+        else:
+            self._f = self.part_path.open("w", newline="", encoding="utf-8", errors="backslashreplace")
+        self._writer = csv.writer(self._f)
+
+    def add(self, tree: FolderTree, node: int) -> None:
+        self._writer.writerow(tree.row(node))
 
+    def close(self, tree: FolderTree) -> None:
+        self._f.close()
+        write_csv(tree, self.out_path)
+        self.part_path.unlink()
 
-def save_log(skipped: List[Tuple[str, str]], log_path: Path) -> None:
-    with log_path.open("w", encoding="utf-8") as f:
-        f.write("Skipped folders log\n")
-        f.write("===================\n")
-        if not skipped:
-            f.write("No skipped folders.\n")
+    def discard(self) -> None:
+        self._f.close()
+        try:
+            self.part_path.unlink()
+        except OSError:
+            pass
+
+
+class JsonlStreamWriter(ScanObserver):
+    """Write one JSON object per line per folder as soon as it is found.
+
+    Records are {"id", "parent_id", "depth", "name", "path"} (path "/"-joined
+    from the root; parent_id null for the root), plus "mtime_ns", "dev" and
+    "inode" when the tree already has them; non-ASCII characters are \\u-escaped. No
+    column count is needed, so lines go straight to the output (or any text
+    stream, e.g. stdout) and are flushed on every progress update for
+    readers following the file (scan_folders registers the sink as an
+    observer). A .gz, .xz or .zst out_path is compressed on a background
+    thread.
+
+    If the reader of stream goes away (BrokenPipeError, e.g. piped into
+    head), writing stops, broken is set and cancel_state, if given, cancels
+    the scan.
+    """
+
+    def __init__(self, out_path: Path, stream=None, cancel_state=None):
+        self.out_path = out_path
+        self.cancel_state = cancel_state
+        self.broken = False
+        self._owned = stream is None
+        self._f = _open_text_output(out_path, "\n") if stream is None else stream
+
+    def add(self, tree: FolderTree, node: int) -> None:
+        if self.broken:
+            return
+        try:
+            self._f.write(_jsonl_record(tree, node))
+        except BrokenPipeError:
+            self._stop()
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        self.flush()
+
+    def flush(self) -> None:
+        if self.broken:
+            return
+        try:
+            self._f.flush()
+        except BrokenPipeError:
+            self._stop()
+
+    def _stop(self) -> None:
+        self.broken = True
+        if self.cancel_state is not None:
+            self.cancel_state["cancel"] = True
+
+    def close(self, tree: Optional[FolderTree] = None) -> None:
+        if self._owned:
+            self._f.close()
+        else:
+            self.flush()
+
+    def discard(self) -> None:
+        self.close()
+        if self._owned:
+            try:
+                self.out_path.unlink()
+            except OSError:
+                pass
+
+
+def _jsonl_record(tree: FolderTree, node: int) -> str:
+    parent = tree.parents[node]
+    record = {"id": node, "parent_id": parent if parent >= 0 else None, "depth": tree.depths[node],
+              "name": tree.names[node], "path": "/".join(tree.row(node))}
+    if tree.mtimes is not None and tree.mtimes[node] >= 0:
+        record["mtime_ns"] = tree.mtimes[node]
+        record["dev"] = tree.devs[node]
+        record["inode"] = tree.inodes[node]
+    # ASCII with \u escapes: a name that is not valid UTF-8 (possible on Linux)
+    # comes through as a lone surrogate, which no UTF-8 stream could encode
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def write_jsonl(tree: FolderTree, out_path: Path) -> None:
+    with _open_text_output(out_path, "\n") as f:
+        for node in range(len(tree)):
+            f.write(_jsonl_record(tree, node))
+
+
+SQLITE_BATCH_ROWS = 50000
+
+
+def _utf8_text(s: str) -> str:
+    """s as valid UTF-8 text: a name that is not valid UTF-8 (possible on
+    Linux) reaches Python with lone surrogates, written here as \\xNN."""
+    try:
+        s.encode("utf-8")
+        return s
+    except UnicodeEncodeError:
+        return os.fsencode(s).decode("utf-8", "backslashreplace")
+
+
+class SqliteStreamWriter:
+    """Write folders to a SQLite database while the scan runs.
+
+    Table folders(id, parent_id, name, depth, path): id is the scan's node
+    number, path the "/"-joined names from the root (a materialized path,
+    indexed, so a subtree is the range path > 'A/B/' AND path < 'A/B0'). With
+    closure, folder_closure(ancestor_id, descendant_id, distance) lists every
+    ancestor/descendant pair, including each folder with itself at distance 0.
+
+    Rows are inserted in large transactions into "<out>.part" with WAL and no
+    fsync; indexes and the closure table are built once, by close(), which then
+    renames the finished file into place.
+    """
+
+    def __init__(self, out_path: Path, closure: bool = False):
+        import sqlite3
+        self.out_path = out_path
+        self.part_path = out_path.with_name(out_path.name + ".part")
+        self.closure = closure
+        for path in (self.part_path, Path(str(self.part_path) + "-wal"), Path(str(self.part_path) + "-shm")):
+            if path.exists():
+                path.unlink()
+        self._db = sqlite3.connect(str(self.part_path))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE folders (id INTEGER PRIMARY KEY, parent_id INTEGER, name TEXT NOT NULL,"
+                         " depth INTEGER NOT NULL, path TEXT NOT NULL)")
+        self._batch: List[Tuple[int, Optional[int], str, int, str]] = []
+
+    def add(self, tree: FolderTree, node: int) -> None:
+        parent = tree.parents[node]
+        self._batch.append((node, parent if parent >= 0 else None, _utf8_text(tree.names[node]), tree.depths[node],
+                            _utf8_text("/".join(tree.row(node)))))
+        if len(self._batch) >= SQLITE_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._db:
+            self._db.executemany("INSERT INTO folders VALUES (?, ?, ?, ?, ?)", self._batch)
+        self._batch.clear()
+
+    def close(self, tree: Optional[FolderTree] = None) -> None:
+        self._flush()
+        db = self._db
+        with db:
+            db.execute("CREATE INDEX folders_parent ON folders (parent_id)")
+            db.execute("CREATE INDEX folders_path ON folders (path)")
+            if self.closure:
+                db.execute("CREATE TABLE folder_closure (ancestor_id INTEGER NOT NULL, descendant_id INTEGER NOT NULL,"
+                           " distance INTEGER NOT NULL, PRIMARY KEY (ancestor_id, descendant_id)) WITHOUT ROWID")
+                db.execute("""
+                    INSERT INTO folder_closure
+                    WITH RECURSIVE up(ancestor_id, descendant_id, distance) AS (
+                        SELECT id, id, 0 FROM folders
+                        UNION ALL
+                        SELECT f.parent_id, up.descendant_id, up.distance + 1
+                        FROM up JOIN folders f ON f.id = up.ancestor_id
+                        WHERE f.parent_id IS NOT NULL)
+                    SELECT ancestor_id, descendant_id, distance FROM up ORDER BY ancestor_id, descendant_id""")
+                db.execute("CREATE INDEX folder_closure_descendant ON folder_closure (descendant_id)")
+        # Back to a single self-contained file
+        db.execute("PRAGMA journal_mode=DELETE")
+        db.close()
+        os.replace(self.part_path, self.out_path)
+
+    def discard(self) -> None:
+        self._db.close()
+        try:
+            self.part_path.unlink()
+        except OSError:
+            pass
+
+
+def write_sqlite(tree: FolderTree, out_path: Path, closure: bool = False) -> None:
+    writer = SqliteStreamWriter(out_path, closure)
+    for node in range(len(tree)):
+        writer.add(tree, node)
+    writer.close()
+
+
+PARQUET_BATCH_ROWS = 65536
+
+
+def write_parquet(rows: Sequence[List[str]], out_path: Path, batch_rows: int = PARQUET_BATCH_ROWS) -> None:
+    """Columnar export for pandas/DuckDB (needs the optional pyarrow package).
+
+    Same Level1..LevelN columns as write_csv, except that missing levels are
+    null rather than "" and each column is dictionary-encoded (folder names
+    repeat heavily down a column). A FolderTree also gets id, parent_id and
+    depth columns. Rows are converted and written batch_rows at a time, so
+    memory does not grow with the tree.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)") from e
+
+    _check_rows(rows)
+    max_levels = _max_levels(rows)
+    tree = rows if isinstance(rows, FolderTree) else None
+    fields = [pa.field(f"Level{i}", pa.dictionary(pa.int32(), pa.string())) for i in range(1, max_levels + 1)]
+    if tree is not None:
+        fields[:0] = [pa.field("id", pa.int32(), nullable=False), pa.field("parent_id", pa.int32()),
+                      pa.field("depth", pa.int32(), nullable=False)]
+    schema = pa.schema(fields)
+
+    def record_batch(batch: List[List[str]], start: int):
+        columns = []
+        if tree is not None:
+            end = start + len(batch)
+            columns.append(pa.array(range(start, end), pa.int32()))
+            columns.append(pa.array([p if p >= 0 else None for p in tree.parents[start:end]], pa.int32()))
+            columns.append(pa.array(tree.depths[start:end], pa.int32()))
+        for level in range(max_levels):
+            names = pa.array([r[level] if level < len(r) else None for r in batch], pa.string())
+            columns.append(names.dictionary_encode())
+        return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+    with pq.ParquetWriter(str(out_path), schema) as writer:
+        batch: List[List[str]] = []
+        start = 0
+        for r in rows:
+            batch.append(r)
+            if len(batch) == batch_rows:
+                writer.write_table(pa.Table.from_batches([record_batch(batch, start)]))
+                start += len(batch)
+                batch = []
+        if batch or not start:
+            writer.write_table(pa.Table.from_batches([record_batch(batch, start)], schema=schema))
+
+
+# Output formats by file suffix; anything else is written as CSV (see output_target)
+OUTPUT_FORMATS = {".xlsx": "xlsx", ".csv": "csv", ".db": "sqlite", ".sqlite": "sqlite", ".sqlite3": "sqlite", ".parquet": "parquet",
+                  ".jsonl": "jsonl", ".ndjson": "jsonl"}
+FORMAT_SUFFIXES = {"xlsx": ".xlsx", "csv": ".csv", "sqlite": ".db", "parquet": ".parquet", "jsonl": ".jsonl"}
+
+
+def output_format(out_path: Path) -> Optional[str]:
+    """The format out_path's suffix names (looking past .gz/.xz/.zst), or None."""
+    suffix = out_path.suffix.lower()
+    if suffix in COMPRESSION_SUFFIXES:
+        suffix = Path(out_path.stem).suffix.lower()
+    return OUTPUT_FORMATS.get(suffix)
+
+
+def output_target(out_path: Path) -> Tuple[str, Path]:
+    """(format, file to write) for an output file chosen by name. Unknown
+    suffixes get CSV, as the GUI always did, with the suffix replaced: out.txt
+    is written as out.csv (out.txt.gz as out.csv.gz)."""
+    fmt = output_format(out_path)
+    if fmt is not None:
+        return fmt, out_path
+    compression = out_path.suffix if _compression(out_path) is not None else ""
+    base = out_path.with_suffix("") if compression else out_path
+    return "csv", base.with_name(base.stem + ".csv" + compression)
+
+
+def missing_dependency(fmt: str, out_path: Optional[Path] = None) -> Optional[str]:
+    """Why fmt (to out_path) cannot be written here, checked before scanning
+    rather than at the end."""
+    import importlib.util
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        return "Parquet output needs pyarrow (pip install pyarrow)"
+    method = _compression(out_path) if out_path is not None else None
+    if method is not None and fmt not in ("csv", "jsonl"):
+        return f"Only csv and jsonl output can be compressed ({out_path.name})"
+    if method == "zstd" and importlib.util.find_spec("zstandard") is None:
+        return ".zst output needs zstandard (pip install zstandard)"
+    return None
+
+
+def stream_writer(out_path: Path, fmt: str, sqlite_closure: bool = False):
+    """The sink that writes fmt while scanning, or None for formats (xlsx,
+    parquet) whose layout depends on the finished tree; see write_output.
+    Close it with close(tree), tree being what the scan returned."""
+    if fmt == "csv":
+        return CsvStreamWriter(out_path)
+    if fmt == "sqlite":
+        return SqliteStreamWriter(out_path, closure=sqlite_closure)
+    if fmt == "jsonl":
+        return JsonlStreamWriter(out_path)
+    return None
+
+
+def write_output(tree: FolderTree, out_path: Path, fmt: str, split_by_top_level: bool = False, excel_engine: str = "native", sqlite_closure: bool = False, on_phase: Optional[Callable[[str], None]] = None) -> None:
+    """Write a finished scan in any output format (on_phase: see write_excel)."""
+    if fmt == "csv":
+        write_csv(tree, out_path)
+    elif fmt == "sqlite":
+        write_sqlite(tree, out_path, closure=sqlite_closure)
+    elif fmt == "parquet":
+        write_parquet(tree, out_path)
+    elif fmt == "jsonl":
+        write_jsonl(tree, out_path)
+    else:
+        write_excel(tree, out_path, split_by_top_level=split_by_top_level, engine=excel_engine, on_phase=on_phase)
+
+
+MEMORY_PROFILE_TOP = 15
+
+
+class MemoryProfiler:
+    """--profile-memory: tracemalloc snapshots at phase boundaries.
+
+    start() begins tracing; phase(name) closes the current phase, recording the
+    traced memory still held, the peak since the previous phase and the
+    allocation sites holding the most memory; write_report() writes it all out.
+    Tracing every allocation makes the run up to ten times slower, and the
+    numbers cover Python allocations only (not e.g. sqlite's own caches).
+    """
+
+    def __init__(self, top: int = MEMORY_PROFILE_TOP):
+        self.top = top
+        # (name, seconds, current bytes, peak bytes, [(site, bytes, blocks)])
+        self.phases: List[Tuple[str, float, int, int, List[Tuple[str, int, int]]]] = []
+        self._last = 0.0
+
+    def start(self) -> None:
+        import tracemalloc
+        tracemalloc.start()
+        self._last = time.monotonic()
+
+    def phase(self, name: str) -> None:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
             return
-        for path, reason in skipped:
-            f.write(f"{path} | {reason}\n")
+        current, peak = tracemalloc.get_traced_memory()
+        now = time.monotonic()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        sites = [(str(stat.traceback[0]), stat.size, stat.count) for stat in snapshot.statistics("lineno")[:self.top]]
+        del snapshot
+        self.phases.append((name, now - self._last, current, peak, sites))
+        # Taking the snapshot allocates too; start the next phase after it
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self._last = time.monotonic()
+
+    def stop(self) -> None:
+        import tracemalloc
+        tracemalloc.stop()
+
+    def write_report(self, report_path: Path) -> None:
+        with report_path.open("w", encoding="utf-8") as f:
+            f.write("Memory profile (tracemalloc)\n")
+            f.write("============================\n")
+            f.write(f"{'phase':<10} {'seconds':>9} {'held MB':>9} {'peak MB':>9}\n")
+            for name, seconds, current, peak, sites in self.phases:
+                f.write(f"{name:<10} {seconds:>9.2f} {current / 2**20:>9.1f} {peak / 2**20:>9.1f}\n")
+            for name, seconds, current, peak, sites in self.phases:
+                f.write(f"\n[{name}] top allocation sites still held at the end of the phase\n")
+                for site, size, count in sites:
+                    f.write(f"{size / 2**20:>9.1f} MB {count:>10} blocks  {site}\n")
 
 
 def to_long_path(p: Path, enable: bool) -> Path:
@@ -140,73 +1117,1346 @@ def to_long_path(p: Path, enable: bool) -> Path:
             long_s = '\\\\?\\' + s
         return Path(long_s)
     return p
-def scan_folders_with_progress(root: Path, use_long_paths: bool, progress_win, lbl_count, lbl_path, cancel_state) -> Tuple[List[List[str]], List[Tuple[str, str]]]:
-    """Scan folders recursively while updating a small progress window. Supports Cancel."""
-    rows: List[List[str]] = []
+
+
+def _dir_error_reason(e: OSError) -> str:
+    if hasattr(e, "winerror") and e.winerror == 3:
+        return "WinError 3 (path not found) - likely placeholder/online-only or moved"
+    if e.errno == errno.ENOENT:
+        return "ENOENT (no such file or directory)"
+    if e.errno == errno.EACCES:
+        return "EACCES (permission denied)"
+    return f"os error: {e}"
+
+
+def _entry_error_reason(e: OSError) -> str:
+    if hasattr(e, "winerror") and e.winerror == 3:
+        return "WinError 3 (path not found) - likely placeholder/online-only or moved"
+    return f"is_dir failed: {e}"
+
+
+# Categories of skipped folders in the scan log (see skip_category)
+SKIP_CATEGORIES = ("permission", "not_found", "path_not_found", "name_too_long", "not_a_directory",
+                   "symlink_loop", "io", "other")
+
+_SKIP_ERRNOS = {errno.EACCES: "permission", errno.EPERM: "permission", errno.ENOENT: "not_found",
+                errno.ENAMETOOLONG: "name_too_long", errno.ENOTDIR: "not_a_directory",
+                errno.ELOOP: "symlink_loop", errno.EIO: "io"}
+# Checked first: Windows maps several of these onto the same errno
+_SKIP_WINERRORS = {5: "permission", 2: "not_found", 3: "path_not_found", 206: "name_too_long", 267: "not_a_directory"}
+
+
+def skip_category(errno_code: Optional[int], winerror: Optional[int] = None) -> str:
+    """One of SKIP_CATEGORIES for an OSError's errno and winerror. path_not_found
+    is WinError 3, typically an online-only placeholder or a folder moved
+    during the scan."""
+    if winerror is not None and winerror in _SKIP_WINERRORS:
+        return _SKIP_WINERRORS[winerror]
+    return _SKIP_ERRNOS.get(errno_code, "other")
+
+
+def _error_codes(e: OSError) -> Tuple[Optional[int], Optional[int]]:
+    return e.errno, getattr(e, "winerror", None)
+
+
+def _list_subdirs(dir_path: str, cancel_state, previous: Optional[FolderTree] = None, prev_node: int = -1, record_meta: bool = False, open_fd: bool = False, parent_fd: Optional[int] = None, latency: Optional["DirLatency"] = None) -> Tuple[Optional[Tuple[int, int, int, bool]], List[Tuple[str, str, str, int]], Optional[int]]:
+    """List one directory without descending.
+
+    Returns (meta, items, fd). items are ("dir", path, name, prev_child) and
+    ("skip", path, reason, (errno, winerror)) in scandir order, so the caller
+    can rebuild exactly what the recursive walk would have produced. prev_child
+    is the matching node in previous (or -1). A skip of dir_path itself means
+    it could not be listed; any other skip is an entry of it.
+
+    Paths are plain strings. dir_path already carries any long-path prefix
+    (the root is converted once and children inherit it from entry.path), so
+    the per-folder work is no more than a string join.
+
+    With record_meta, meta is (mtime_ns, dev, inode, reused) for the directory
+    itself, or None if it could not be listed. If previous is a snapshot tree in which prev_node still has the
+    same mtime, device and inode, the directory's entries have not changed, so it is
+    not listed at all: its children come from previous and reused is True.
+    The same goes, without even the stat, for nodes marked in previous.clean.
+
+    With open_fd (see DIR_FD_SUPPORTED) the directory is opened as an fd,
+    relative to parent_fd if given (openat: no full path lookup, and no
+    surprises if an ancestor is renamed mid-scan), and listed through it. The
+    open fd is returned for the caller to open the children with, and to
+    close; fd is None otherwise or if the directory could not be opened.
+
+    latency, if given, gets the time taken to open, stat and list the
+    directory (not for directories reused from previous).
+    """
+    items: List[Tuple[str, str, str, int]] = []
+    meta = None
+    fd = None
+    entries = 0
+    started = time.perf_counter() if latency is not None else 0.0
+    try:
+        scan_target = dir_path
+        if open_fd:
+            if parent_fd is not None:
+                fd = os.open(os.path.basename(dir_path), _DIR_OPEN_FLAGS | os.O_NOFOLLOW, dir_fd=parent_fd)
+            else:
+                fd = os.open(scan_target, _DIR_OPEN_FLAGS)
+            scan_target = fd
+        if record_meta:
+            if prev_node >= 0 and previous.clean is not None and previous.clean[prev_node]:
+                meta = (previous.mtimes[prev_node], previous.devs[prev_node], previous.inodes[prev_node], True)
+            else:
+                st = os.stat(scan_target)
+                reused = prev_node >= 0 and previous.unchanged(prev_node, st.st_mtime_ns, st.st_dev, st.st_ino)
+                meta = (st.st_mtime_ns, st.st_dev, st.st_ino, reused)
+            if meta[3]:
+                for child in previous.children(prev_node):
+                    name = previous.names[child]
+                    items.append(("dir", os.path.join(dir_path, name), name, child))
+                return meta, items, fd
+        prev_children = None
+        if prev_node >= 0:
+            prev_children = {previous.names[c]: c for c in previous.children(prev_node)}
+        # Entries of an fd listing only carry their name
+        base = dir_path if fd is not None else None
+        with os.scandir(scan_target) as it:
+            for entry in it:
+                if cancel_state["cancel"]:
+                    return meta, items, fd
+                entries += 1
+                path = entry.path if base is None else os.path.join(base, entry.name)
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                except OSError as e:
+                    items.append(("skip", path, _entry_error_reason(e), _error_codes(e)))
+                    continue
+                prev_child = prev_children.get(entry.name, -1) if prev_children else -1
+                items.append(("dir", path, entry.name, prev_child))
+    except OSError as e:
+        items.append(("skip", dir_path, _dir_error_reason(e), _error_codes(e)))
+        # Without mtime/inode the folder is never taken as unchanged, so the
+        # next incremental scan lists it again instead of reusing no children
+        meta = None
+        if fd is not None:
+            os.close(fd)
+            fd = None
+    if latency is not None:
+        latency.record(dir_path, time.perf_counter() - started, entries)
+    return meta, items, fd
+
+
+_DIR_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+
+class _DirFds:
+    """Directory fds of listed folders whose subfolders are still waiting to
+    be listed, so those can be opened relative to them.
+
+    Each fd is kept with a count of its pending children and closed when the
+    last of them has been opened. At most limit are held; beyond that a
+    folder's fd is closed right away and its children are opened by full path.
+    """
+
+    def __init__(self, limit: int = DIR_FD_LIMIT):
+        self.limit = limit
+        self._fds: Dict[int, int] = {}
+        self._pending: Dict[int, int] = {}
+
+    def get(self, node: int) -> Optional[int]:
+        return self._fds.get(node)
+
+    def keep(self, node: int, fd: Optional[int], children: int) -> None:
+        if fd is None:
+            return
+        if children and len(self._fds) < self.limit:
+            self._fds[node] = fd
+            self._pending[node] = children
+        else:
+            os.close(fd)
+
+    def release(self, node: int) -> None:
+        """One child of node has been opened."""
+        left = self._pending.get(node)
+        if left is None:
+            return
+        if left > 1:
+            self._pending[node] = left - 1
+        else:
+            del self._pending[node]
+            os.close(self._fds.pop(node))
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        self._pending.clear()
+
+
+# Listing a folder that fails with ENOENT / WinError 3 (often a sync-client
+# placeholder being materialized or renamed) is tried again this many times,
+# first after RETRY_DELAY seconds, doubling up to RETRY_MAX_DELAY
+RETRY_ATTEMPTS = 3
+RETRY_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+RETRY_CATEGORIES = ("not_found", "path_not_found")
+
+
+class _RetryQueue:
+    """Folders whose listing failed with a possibly transient error, waiting to
+    be listed again. The scan loops go on with other folders meanwhile and
+    pick up due() work when they check the clock anyway; only when nothing
+    else is left do they sleep until wait_time().
+
+    Works are whatever the engine queues; nodes are keyed by tree node.
+    """
+
+    def __init__(self, attempts: int = RETRY_ATTEMPTS, delay: float = RETRY_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self._heap: List[Tuple[float, int, tuple]] = []
+        self._tries: Dict[int, int] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, node: int) -> bool:
+        """True if node's listing has been retried (or is waiting to be)."""
+        return node in self._tries
+
+    def retry(self, node: int, work: tuple, items: List[Tuple[str, str, str, object]], dir_path: str) -> bool:
+        """Queue work again if the listing of dir_path failed with one of
+        RETRY_CATEGORIES and node has attempts left. Otherwise returns False,
+        after noting the retries in the skip reason if there were any."""
+        if not items or items[-1][0] != "skip" or items[-1][1] != dir_path:
+            return False
+        kind, path, reason, codes = items[-1]
+        if skip_category(codes[0], codes[1]) not in RETRY_CATEGORIES:
+            return False
+        tries = self._tries.get(node, 0)
+        if tries >= self.attempts:
+            if tries:
+                items[-1] = (kind, path, f"{reason} (still failing after {tries} retries)", codes)
+            return False
+        self._tries[node] = tries + 1
+        due = time.monotonic() + min(self.max_delay, self.delay * 2 ** tries)
+        heapq.heappush(self._heap, (due, self._seq, work))
+        self._seq += 1
+        return True
+
+    def due(self) -> List[tuple]:
+        now = time.monotonic()
+        works = []
+        while self._heap and self._heap[0][0] <= now:
+            works.append(heapq.heappop(self._heap)[2])
+        return works
+
+    def wait_time(self) -> float:
+        return max(0.0, self._heap[0][0] - time.monotonic()) if self._heap else 0.0
+
+    def drain(self) -> List[tuple]:
+        """All queued work, e.g. for a checkpoint; retried again on resume."""
+        return [entry[2] for entry in self._heap]
+
+
+SNAPSHOT_VERSION = 2
+
+
+def _pack_array(a: "array") -> str:
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return base64.b64encode(a.tobytes()).decode("ascii")
+
+
+def _unpack_array(typecode: str, data: str) -> "array":
+    a = array(typecode)
+    a.frombytes(base64.b64decode(data))
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+def _dump_json_gz(data: dict, path: Path) -> None:
+    """Written to a temp file and renamed into place, so an interrupted save
+    never leaves a truncated file behind."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _load_json_gz(path: Path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _pack_tree(tree: FolderTree) -> dict:
+    data = {"names": tree.names, "parents": _pack_array(tree.parents), "reused_dirs": tree.reused_dirs}
+    if tree.mtimes is not None:
+        data["mtimes"] = _pack_array(tree.mtimes)
+        data["devs"] = _pack_array(tree.devs)
+        data["inodes"] = _pack_array(tree.inodes)
+    return data
+
+
+def _unpack_tree(data: dict) -> FolderTree:
+    names = data["names"]
+    parents = _unpack_array("i", data["parents"])
+    tree = FolderTree(names[0])
+    for node in range(1, len(names)):
+        tree.add(parents[node], names[node])
+    if "mtimes" in data:
+        tree.mtimes = _unpack_array("q", data["mtimes"])
+        tree.devs = _unpack_array("q", data["devs"])
+        tree.inodes = _unpack_array("q", data["inodes"])
+    tree.reused_dirs = data.get("reused_dirs", 0)
+    return tree
+
+
+def save_snapshot(tree: FolderTree, root: Path, snapshot_path: Path) -> None:
+    """Persist a scan (names, parents, directory mtimes/devices/inodes) for later
+    incremental rescans."""
+    data = {"version": SNAPSHOT_VERSION, "root": str(root), "scanned_at_ns": tree.scanned_at_ns}
+    data.update(_pack_tree(tree))
+    _dump_json_gz(data, snapshot_path)
+
+
+def load_snapshot(snapshot_path: Path) -> Tuple[str, FolderTree]:
+    """Returns (root path the snapshot was taken of, tree with metadata)."""
+    data = _load_json_gz(snapshot_path)
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{snapshot_path}: unsupported snapshot version {data.get('version')!r}")
+    tree = _unpack_tree(data)
+    tree.scanned_at_ns = data["scanned_at_ns"]
+    tree.index_children()
+    return data["root"], tree
+
+
+def diff_trees(old: FolderTree, new: FolderTree) -> Iterator[Tuple[str, str, str]]:
+    """Stream (change, path, previous path) for folders that differ between two
+    scans of the same root, both taken with directory metadata (a snapshot and a
+    record_meta/previous scan). change is "added", "removed", "renamed" (same
+    parent, new name) or "moved" (new parent, maybe also a new name).
+
+    Folders are matched by (device, inode), falling back to parent + name
+    where the filesystem reports no inode. A moved or renamed folder is
+    reported once; its subfolders keep their place relative to it and are not
+    listed. Memory is one file id map over old plus an int per node of new,
+    never the rows.
+    """
+    if old.inodes is None or new.inodes is None:
+        raise ValueError("diff_trees needs trees scanned with directory metadata")
+    by_id: Dict[Tuple[int, int], int] = {}
+    old_inodes = old.inodes
+    for node in range(1, len(old)):
+        file_id = old.file_id(node)
+        if file_id is not None:
+            by_id[file_id] = node
+    matched = bytearray(len(old))
+    matched[0] = 1
+    # Node in new -> matching node in old (-1 for added folders)
+    old_of = array("i", [0])
+    new_names, new_parents = new.names, new.parents
+
+    def path(tree: FolderTree, node: int) -> str:
+        return "/".join(tree.row(node))
+
+    for node in range(1, len(new)):
+        parent_old = old_of[new_parents[node]]
+        file_id = new.file_id(node)
+        o = by_id.get(file_id, -1) if file_id is not None else -1
+        if o < 0 or matched[o]:
+            o = -1
+            if parent_old >= 0:
+                name = new_names[node]
+                for child in old.children(parent_old):
+                    if old.names[child] == name and not matched[child] and old_inodes[child] <= 0:
+                        o = child
+                        break
+        old_of.append(o)
+        if o < 0:
+            yield "added", path(new, node), ""
+            continue
+        matched[o] = 1
+        if old.parents[o] != parent_old:
+            yield "moved", path(new, node), path(old, o)
+        elif old.names[o] != new_names[node]:
+            yield "renamed", path(new, node), path(old, o)
+    for node in range(1, len(old)):
+        if not matched[node]:
+            yield "removed", "", path(old, node)
+
+
+def write_diff_csv(changes: Iterable[Tuple[str, str, str]], out_path: Path) -> int:
+    """Write diff_trees() output as CSV; returns the number of changes."""
+    count = 0
+    with out_path.open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["Change", "Path", "Previous path"])
+        for change in changes:
+            w.writerow(change)
+            count += 1
+    return count
+
+
+CHECKPOINT_VERSION = 4
+CHECKPOINT_INTERVAL = 60.0
+
+
+def checkpoint_path_for(out_path: Path) -> Path:
+    return out_path.with_suffix(".checkpoint.json.gz")
+
+
+def load_checkpoint(checkpoint_path: Path) -> dict:
+    """Load a checkpoint written by an interrupted scan_folders(checkpoint=...) run;
+    pass the result back as scan_folders(resume=...)."""
+    data = _load_json_gz(checkpoint_path)
+    if data.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{checkpoint_path}: unsupported checkpoint version {data.get('version')!r}")
+    return data
+
+
+class _Checkpointer:
+    """Saves the scan state (tree so far, skips, pending work) every interval
+    seconds. The interval stretches to at least 10x the time the previous save
+    took, so very large trees do not spend their time checkpointing."""
+
+    def __init__(self, path: Path, root: Path, order: str, scanned_at_ns: int, interval: float):
+        self.path = path
+        self.header = {"version": CHECKPOINT_VERSION, "root": str(root), "order": order, "scanned_at_ns": scanned_at_ns}
+        self.interval = interval
+        self._next = time.monotonic() + interval
+
+    def due(self) -> bool:
+        return time.monotonic() >= self._next
+
+    def save(self, state: dict) -> None:
+        started = time.monotonic()
+        data = dict(self.header)
+        data.update(state)
+        _dump_json_gz(data, self.path)
+        took = time.monotonic() - started
+        self._next = time.monotonic() + max(self.interval, 10 * took)
+
+
+PROGRESS_INTERVAL = 0.05
+
+
+class _ProgressDispatcher:
+    """Fans scan events out to observers without reading the clock per folder.
+
+    The scan loops count folders down from the value poll() returns and only
+    call poll() at zero. poll() reads the clock and doubles or halves the
+    countdown so that checks land roughly once per interval, however fast
+    folders are coming in.
+    """
+
+    def __init__(self, observers: Iterable[ScanObserver], interval: float = PROGRESS_INTERVAL, keep_polling: bool = False):
+        self.observers = list(observers)
+        self.interval = interval
+        # Something other than the observers (checkpoints) relies on poll()
+        self.keep_polling = keep_polling
+        self.start = self._last = time.monotonic()
+        self._last_found = 0
+        self._every = 1
+        self.skipped = 0
+
+    def poll(self, found: int, tree: FolderTree, node: int) -> int:
+        if not self.observers and not self.keep_polling:
+            return 1 << 30
+        now = time.monotonic()
+        elapsed = now - self._last
+        if elapsed < self.interval:
+            if self._every < 4096:
+                self._every *= 2
+            return self._every
+        if elapsed > 2 * self.interval and self._every > 1:
+            self._every //= 2
+        rate = (found - self._last_found) / elapsed
+        self._last, self._last_found = now, found
+        current = tree.tail(node)
+        for o in self.observers:
+            o.on_progress(found, current, rate)
+        return self._every
+
+    def skip(self, path: str, reason: str, errno_code: Optional[int], winerror: Optional[int], depth: int) -> None:
+        self.skipped += 1
+        category = skip_category(errno_code, winerror)
+        for o in self.observers:
+            o.on_skip_detail(path, reason, category, errno_code, winerror, depth)
+
+    def finish(self, found: int, skipped: int, cancelled: bool) -> None:
+        elapsed = time.monotonic() - self.start
+        for o in self.observers:
+            o.on_finish(found, skipped, elapsed, cancelled)
+
+
+class TkProgress(ScanObserver):
+    """Shows the folder count and current path in the progress window's labels.
+
+    The scan runs on a worker thread and Tk widgets may only be touched from
+    the Tk thread, so the callbacks just queue events; poll() runs on the Tk
+    thread (via after()) and applies the latest one.
+    """
+
+    def __init__(self, progress_win, lbl_count, lbl_path):
+        self.progress_win = progress_win
+        self.lbl_count = lbl_count
+        self.lbl_path = lbl_path
+        self.events: "queue.Queue" = queue.Queue()
+        self.finished = False
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        self.events.put((found, current))
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        self.events.put((found, None))
+
+    def poll(self) -> bool:
+        """Apply queued progress to the labels. Returns True once the scan has finished."""
+        latest = None
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[1] is None:
+                self.finished = True
+            latest = event
+        if latest is not None:
+            self.lbl_count.config(text=f"Folders found: {latest[0]}")
+            if latest[1] is not None:
+                self.lbl_path.config(text=f"Current: {latest[1]}")
+        return self.finished
+
+
+class ConsoleProgress(ScanObserver):
+    """Single self-overwriting status line on a terminal (stderr by default)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        print(f"\rFolders found: {found} ({rate:,.0f}/s)  Current: {current[-50:]:<50}", end="", file=self.stream, flush=True)
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        print(file=self.stream)
+
+
+class ScanMetrics(ScanObserver):
+    """Collects counters for reporting: totals, skip reasons, throughput."""
+
+    def __init__(self):
+        self.found = 0
+        self.skipped = 0
+        self.skip_reasons: Dict[str, int] = {}
+        self.peak_rate = 0.0
+        self.elapsed = 0.0
+        self.cancelled = False
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        self.found = found
+        if rate > self.peak_rate:
+            self.peak_rate = rate
+
+    def on_skip(self, path: str, reason: str) -> None:
+        self.skipped += 1
+        key = reason.split(" ", 1)[0]
+        self.skip_reasons[key] = self.skip_reasons.get(key, 0) + 1
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        self.found = found
+        self.elapsed = elapsed
+        self.cancelled = cancelled
+
+    @property
+    def rate(self) -> float:
+        return self.found / self.elapsed if self.elapsed else 0.0
+
+
+SCAN_LOG_FIELDS = ["record", "time", "depth", "category", "errno", "winerror", "path", "reason", "count"]
+
+
+def _iso_time(t: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t)) + f".{int(t * 1000) % 1000:03d}Z"
+
+
+class ScanLogWriter(ScanObserver):
+    """Streams skipped folders to a machine-readable log as the scan finds them.
+
+    JSON Lines by default, CSV if log_path ends in .csv. Every skip is a
+    "skip" record with the time (UTC), folder depth, category (one of
+    SKIP_CATEGORIES), errno, winerror, path and reason; on_finish appends a
+    "summary" record with the counts per category (in CSV one row per
+    category, plus a "total" row). Nothing is kept per skip, so the log can be
+    any size. With append=True (a resumed scan) records go after the earlier
+    run's. Call close() when the scan is done.
+
+    Paths that are not valid UTF-8 (possible on Linux) are escaped: \\u in
+    JSON, backslashreplace in CSV. If writing fails anyway (disk full, ...)
+    the error is kept in error and the log stops, but the scan goes on.
+    """
+
+    def __init__(self, log_path: Path, append: bool = False):
+        self.log_path = log_path
+        self.fmt = "csv" if log_path.suffix.lower() == ".csv" else "jsonl"
+        write_header = self.fmt == "csv" and not (append and log_path.exists() and log_path.stat().st_size)
+        self._f = log_path.open("a" if append else "w", encoding="utf-8", errors="backslashreplace", newline="")
+        self._csv = csv.writer(self._f) if self.fmt == "csv" else None
+        if write_header:
+            self._csv.writerow(SCAN_LOG_FIELDS)
+        self.counts: Dict[str, int] = {}
+        self.skipped = 0
+        self.error: Optional[Exception] = None
+
+    def on_skip_detail(self, path: str, reason: str, category: str, errno_code: Optional[int], winerror: Optional[int], depth: int) -> None:
+        self.skipped += 1
+        self.counts[category] = self.counts.get(category, 0) + 1
+        if self.error is not None:
+            return
+        now = _iso_time(time.time())
+        try:
+            if self._csv is not None:
+                self._csv.writerow(["skip", now, depth, category, errno_code, winerror, path, reason, None])
+            else:
+                self._f.write(json.dumps({"record": "skip", "time": now, "depth": depth, "category": category,
+                                          "errno": errno_code, "winerror": winerror, "path": path,
+                                          "reason": reason}) + "\n")
+        except (OSError, ValueError) as e:
+            self.error = e
+
+    def on_progress(self, found: int, current: str, rate: float) -> None:
+        # Rate limited, so a cheap way to keep the file current for tail -f
+        if self.error is None:
+            try:
+                self._f.flush()
+            except (OSError, ValueError) as e:
+                self.error = e
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        if self.error is None:
+            try:
+                self._write_summary(found, elapsed, cancelled)
+            except (OSError, ValueError) as e:
+                self.error = e
+
+    def _write_summary(self, found: int, elapsed: float, cancelled: bool) -> None:
+        now = _iso_time(time.time())
+        if self._csv is not None:
+            for category in SKIP_CATEGORIES:
+                if category in self.counts:
+                    self._csv.writerow(["summary", now, None, category, None, None, None, None, self.counts[category]])
+            self._csv.writerow(["summary", now, None, "total", None, None, None,
+                                f"{found} folders in {elapsed:.1f}s{' (canceled)' if cancelled else ''}", self.skipped])
+        else:
+            by_category = {c: self.counts[c] for c in SKIP_CATEGORIES if c in self.counts}
+            self._f.write(json.dumps({"record": "summary", "time": now, "folders": found, "skipped": self.skipped,
+                                      "elapsed": round(elapsed, 3), "cancelled": cancelled,
+                                      "by_category": by_category}) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        try:
+            self._f.close()
+        except OSError as e:
+            if self.error is None:
+                self.error = e
+
+
+def write_scan_log(skips: Iterable[Tuple[str, str, str, Optional[int], Optional[int], int]], log_path: Path, found: int = 0, elapsed: float = 0.0) -> None:
+    """Write a ScanLogWriter log in one go from (path, reason, category, errno,
+    winerror, depth) records, e.g. FolderWatcher's skips."""
+    writer = ScanLogWriter(log_path)
+    try:
+        for record in skips:
+            writer.on_skip_detail(*record)
+        writer.on_finish(found, writer.skipped, elapsed, False)
+    finally:
+        writer.close()
+    if writer.error is not None:
+        raise writer.error
+
+
+LATENCY_TOP = 20
+# Histogram bucket upper bounds in seconds: 1-2-5 steps from 10us to 100s
+LATENCY_BOUNDS = tuple(m * 10.0 ** e for e in range(-5, 2) for m in (1, 2, 5)) + (100.0,)
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.3g}ms"
+    return f"{seconds:.3g}s"
+
+
+class DirLatency(ScanObserver):
+    """Per-directory listing times, for finding slow folders (e.g. sync-client
+    placeholders being hydrated) and tuning --workers.
+
+    record() is called by whichever thread listed the directory, so it takes a
+    lock. Only a histogram over LATENCY_BOUNDS and a heap of the `top` slowest
+    directories are kept, however large the tree.
+    """
+
+    def __init__(self, top: int = LATENCY_TOP):
+        self.top = top
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        # Min-heap of (seconds, entries, path); the root is the fastest of the slowest
+        self.slowest: List[Tuple[float, int, str]] = []
+        self.listed = 0
+        self.entries = 0
+        self.busy = 0.0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, path: str, seconds: float, entries: int) -> None:
+        bucket = bisect.bisect_left(LATENCY_BOUNDS, seconds)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.listed += 1
+            self.entries += entries
+            self.busy += seconds
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, (seconds, entries, path))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, entries, path))
+
+    def on_finish(self, found: int, skipped: int, elapsed: float, cancelled: bool) -> None:
+        self.elapsed = elapsed
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile (inf past the last bound)."""
+        rank = q * self.listed
+        seen = 0
+        for bound, count in zip(LATENCY_BOUNDS + (float("inf"),), self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+    def write_report(self, report_path: Path, workers: int = 1) -> None:
+        with report_path.open("w", encoding="utf-8") as f:
+            f.write("Directory listing latency\n")
+            f.write("=========================\n")
+            f.write(f"Directories listed: {self.listed} ({self.entries} entries)\n")
+            if not self.listed:
+                return
+            f.write(f"Mean: {_format_seconds(self.busy / self.listed)}")
+            for q in (0.5, 0.9, 0.99):
+                bound = self.percentile(q)
+                f.write(f"  p{q * 100:g} <= {_format_seconds(bound) if bound != float('inf') else 'inf'}")
+            f.write("\n")
+            if self.elapsed:
+                # Close to the worker count means the workers were always busy listing
+                f.write(f"Listing time {_format_seconds(self.busy)} over {_format_seconds(self.elapsed)} of scanning: "
+                        f"{self.busy / self.elapsed:.1f} listings in flight on average ({workers} workers)\n")
+            f.write("\nHistogram\n")
+            peak = max(self.counts)
+            lower = 0.0
+            for bound, count in zip(LATENCY_BOUNDS + (float("inf"),), self.counts):
+                if count:
+                    label = f"{_format_seconds(lower)}-{_format_seconds(bound)}" if bound != float("inf") else f">{_format_seconds(lower)}"
+                    f.write(f"{label:>14} {count:>10}  {'#' * max(1, round(50 * count / peak))}\n")
+                lower = bound
+            f.write(f"\nSlowest {len(self.slowest)} directories\n")
+            for seconds, entries, path in sorted(self.slowest, reverse=True):
+                f.write(f"{_format_seconds(seconds):>10} {entries:>8} entries  {path}\n")
+
+
+def _scan_parallel(root: Path, root_lp: str, workers: int, depth_first: bool, cancel_state, progress: _ProgressDispatcher, *, sink=None, previous: Optional[FolderTree] = None, record_meta: bool = False, checkpoint: Optional[_Checkpointer] = None, resume: Optional[dict] = None, dir_fds: bool = False, latency: Optional["DirLatency"] = None, keep_skipped: bool = True, retry: Optional[_RetryQueue] = None) -> Tuple[FolderTree, List[Tuple[str, str]]]:
+    """Thread-pool traversal. Workers only list directories; the calling thread
+    owns the work queue and the node table and is the only one that reports
+    progress (so a Tk observer stays on the Tk thread)."""
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    if retry is None:
+        retry = _RetryQueue(0)
+    in_flight = {}
+    countdown = 1
+    if resume is not None:
+        discovered = _unpack_tree(resume["tree"])
+        reused = discovered.reused_dirs
+        skips: Dict[int, List[Tuple[int, str, str]]] = {int(node): [tuple(record) for record in records]
+                                                         for node, records in resume["skips"].items()}
+        pending: List[Tuple[int, str, int]] = [tuple(work) for work in resume["pending"]]
+        if sink is not None:
+            for node in range(len(discovered)):
+                sink.add(discovered, node)
+    else:
+        discovered = FolderTree(root.name, with_meta=record_meta)
+        skips = {}
+        pending = [(0, root_lp, 0 if previous is not None else -1)]
+        reused = 0
+        if sink is not None:
+            sink.add(discovered, 0)
+
+    def state() -> dict:
+        # Listings still in flight are not in the tree yet; redo them on resume
+        discovered.reused_dirs = reused
+        return {
+            "engine": "parallel",
+            "tree": _pack_tree(discovered),
+            "skips": {str(node): [list(record) for record in records] for node, records in skips.items()},
+            "pending": [list(work) for work in pending + list(in_flight.values()) + retry.drain()],
+        }
+
+    # Only this thread touches fds: a parent's fd is released once the
+    # child's listing is back, so it stays open while a worker uses it.
+    fds = _DirFds() if dir_fds else None
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+    try:
+        while (pending or in_flight or retry) and not cancel_state["cancel"]:
+            if retry:
+                pending.extend(retry.due())
+                if not pending and not in_flight:
+                    time.sleep(min(retry.wait_time(), PROGRESS_INTERVAL))
+                    continue
+            # Keep the pool saturated but bound the number of queued listings;
+            # the rest of the frontier waits in `pending` (LIFO keeps it small).
+            while pending and len(in_flight) < workers * 2:
+                work = pending.pop()
+                node, dir_path, prev = work
+                # A retry goes by full path: its parent's fd was released after the first attempt
+                parent_fd = fds.get(discovered.parents[node]) if fds is not None and node and node not in retry else None
+                in_flight[pool.submit(_list_subdirs, dir_path, cancel_state, previous, prev, record_meta,
+                                      dir_fds, parent_fd, latency)] = work
+            done, _ = wait(in_flight, timeout=0.05, return_when=FIRST_COMPLETED)
+            for fut in done:
+                work = in_flight.pop(fut)
+                node = work[0]
+                meta, items, fd = fut.result()
+                if fds is not None and node and node not in retry:
+                    fds.release(discovered.parents[node])
+                if cancel_state["cancel"]:
+                    # The listing may have been cut short; leave it for a resume
+                    if fd is not None:
+                        os.close(fd)
+                    pending.append(work)
+                    continue
+                if retry.retry(node, work, items, work[1]):
+                    continue
+                if fds is not None:
+                    fds.keep(node, fd, sum(1 for item in items if item[0] == "dir"))
+                if meta is not None:
+                    discovered.set_meta(node, *meta[:3])
+                    reused += meta[3]
+                # A listing's subfolders get consecutive ids, so the tree keeps
+                # their order; only where the skips fell in between is noted
+                listed = 0
+                for kind, path, detail, prev in items:
+                    if kind == "dir":
+                        child = discovered.add(node, detail)
+                        if sink is not None:
+                            sink.add(discovered, child)
+                        listed += 1
+                        pending.append((child, path, prev))
+                    else:
+                        if keep_skipped:
+                            skips.setdefault(node, []).append((listed, path, detail))
+                        depth = discovered.depths[node] + (path != work[1])
+                        progress.skip(path, detail, prev[0], prev[1], depth)
+                countdown -= 1
+                if not countdown:
+                    countdown = progress.poll(len(discovered), discovered, node)
+                    if checkpoint is not None and checkpoint.due():
+                        checkpoint.save(state())
+        for fut in in_flight:
+            fut.cancel()
+        if checkpoint is not None and cancel_state["cancel"]:
+            checkpoint.save(state())
+    finally:
+        pool.shutdown(wait=True)
+        if fds is not None:
+            for fut in in_flight:
+                if not fut.cancelled() and fut.exception() is None and fut.result()[2] is not None:
+                    os.close(fut.result()[2])
+            fds.close()
+
+    # Renumber the tree into the requested order so the tree/skipped come out
+    # exactly as the sequential walk would produce them.
+    discovered.reused_dirs = reused
     skipped: List[Tuple[str, str]] = []
+    discovered.renumber(_walk_order(discovered, depth_first, skips, skipped))
+    return discovered, skipped
+
 
-    root_lp = to_long_path(root, use_long_paths)
-    rows.append([root.name])
-    found = 1
-    last_update = 0.0
-    lbl_count.config(text=f"Folders found: {found}")
-    lbl_path.config(text=f"Current: {root.name}")
-    progress_win.update_idletasks()
+def _scan_sequential(root: Path, root_lp: str, depth_first: bool, cancel_state, progress: _ProgressDispatcher, *, sink=None, previous: Optional[FolderTree] = None, record_meta: bool = False, checkpoint: Optional[_Checkpointer] = None, resume: Optional[dict] = None, dir_fds: bool = False, latency: Optional["DirLatency"] = None, keep_skipped: bool = True, retry: Optional[_RetryQueue] = None) -> Tuple[FolderTree, List[Tuple[str, str]]]:
+    """Iterative walk: one listing is open at a time and there is no recursion
+    limit. Each listing is queued in scandir order (reversed onto the stack for
+    depth-first), with skip records queued alongside the folders so that both
+    the tree and skipped come out in the same order the old recursive walk
+    produced. Folders get their node when popped, so node order is output order.
+
+    Pending items are (path, parent, name, prev) for folders still to be added,
+    (path, None, (reason, errno, winerror, depth), -1) for skips, and
+    (path, node, None, prev) for a folder that is in the tree but still has to
+    be listed.
+
+    A folder listed again by retry gets its subfolders' nodes at that point,
+    after the rest of the tree, so the tree is put back in order at the end."""
+    if retry is None:
+        retry = _RetryQueue(0)
+    countdown = 1
+    retried = False
+    if resume is not None:
+        retried = resume.get("retried", False)
+        tree = _unpack_tree(resume["tree"])
+        skipped: List[Tuple[str, str]] = [tuple(item) for item in resume["skipped"]]
+        pending = deque(tuple(work) for work in resume["pending"])
+        if sink is not None:
+            for node in range(len(tree)):
+                sink.add(tree, node)
+    else:
+        tree = FolderTree(root.name, with_meta=record_meta)
+        skipped = []
+        pending = deque()
+        if sink is not None:
+            sink.add(tree, 0)
+    found = len(tree)
+    requeue = pending.append if depth_first else pending.appendleft
 
-    def walk_dir(dir_path: Path, ancestors: List[str]):
-        nonlocal found, last_update
+    def state() -> dict:
+        return {
+            "engine": "sequential",
+            "tree": _pack_tree(tree),
+            "skipped": skipped,
+            "pending": [list(work) for work in list(pending) + retry.drain()],
+            "retried": retried,
+        }
+
+    fds = _DirFds() if dir_fds else None
+
+    def visit(dir_path: str, node: int, prev: int) -> None:
+        # A retry goes by full path: its parent's fd was released after the first attempt
+        parent_fd = fds.get(tree.parents[node]) if fds is not None and node and node not in retry else None
+        meta, items, fd = _list_subdirs(dir_path, cancel_state, previous, prev, record_meta,
+                                        dir_fds, parent_fd, latency)
+        if fds is not None and node and node not in retry:
+            fds.release(tree.parents[node])
         if cancel_state["cancel"]:
+            # The listing may have been cut short; list this folder again on resume
+            if fd is not None:
+                os.close(fd)
+            requeue((dir_path, node, None, prev))
             return
+        if retry.retry(node, (dir_path, node, None, prev), items, dir_path):
+            return
+        if fds is not None:
+            fds.keep(node, fd, sum(1 for item in items if item[0] == "dir"))
+        if meta is not None:
+            tree.set_meta(node, *meta[:3])
+            tree.reused_dirs += meta[3]
+        depth = tree.depths[node]
+        work = [(path, node, detail, prev_child) if kind == "dir"
+                else (path, None, (detail, prev_child[0], prev_child[1], depth + (path != dir_path)), -1)
+                for kind, path, detail, prev_child in items]
+        pending.extend(reversed(work) if depth_first else work)
+
+    try:
+        if resume is None:
+            visit(root_lp, 0, 0 if previous is not None else -1)
+        pop = pending.pop if depth_first else pending.popleft
+        while (pending or retry) and not cancel_state["cancel"]:
+            if not pending:
+                time.sleep(min(retry.wait_time(), PROGRESS_INTERVAL))
+                due = retry.due()
+                retried = retried or bool(due)
+                pending.extend(due)
+                continue
+            path, parent, detail, prev = pop()
+            if parent is None:
+                reason, errno_code, winerror, depth = detail
+                if keep_skipped:
+                    skipped.append((path, reason))
+                progress.skip(path, reason, errno_code, winerror, depth)
+                continue
+            if detail is None:
+                visit(path, parent, prev)
+                continue
+            node = tree.add(parent, detail)
+            found += 1
+            if sink is not None:
+                sink.add(tree, node)
+
+            countdown -= 1
+            if not countdown:
+                countdown = progress.poll(found, tree, node)
+                if checkpoint is not None and checkpoint.due():
+                    checkpoint.save(state())
+                if retry:
+                    due = retry.due()
+                    retried = retried or bool(due)
+                    for work in due:
+                        requeue(work)
+
+            visit(path, node, prev)
+
+        if checkpoint is not None and cancel_state["cancel"]:
+            checkpoint.save(state())
+    finally:
+        if fds is not None:
+            fds.close()
+    if retried:
+        tree.renumber(_walk_order(tree, depth_first))
+    return tree, skipped
+
+
+def scan_folders(root: Path, use_long_paths: bool, cancel_state, observers: Iterable[ScanObserver] = (), workers: int = 1, order: str = "dfs", sink=None, previous: Optional[FolderTree] = None, record_meta: bool = False, checkpoint: Optional[Path] = None, checkpoint_interval: float = CHECKPOINT_INTERVAL, resume: Optional[dict] = None, dir_fds: bool = False, latency: Optional["DirLatency"] = None, keep_skipped: bool = True, retries: int = RETRY_ATTEMPTS) -> Tuple[FolderTree, List[Tuple[str, str]]]:
+    """Scan folders recursively without any UI. Stops early once cancel_state["cancel"] is set.
+
+    Progress, skips and the end of the scan are reported to observers (see
+    ScanObserver). With workers > 1 directories are listed concurrently by a
+    thread pool (scandir releases the GIL, so this pays off on high-latency
+    network/sync-client mounts). order is "dfs" (default, parent then its whole
+    subtree) or "bfs" (level by level). Returns the folders as a FolderTree
+    (iterate it for Level rows) plus skips.
+
+    sink, if given, gets sink.add(tree, node) for every folder as soon as it is
+    found (e.g. CsvStreamWriter), nodes in increasing id order. With workers > 1
+    (or after a retry) that is discovery order rather than the final DFS/BFS
+    order, and the returned tree is renumbered into the latter. A sink that is
+    also a ScanObserver (JsonlStreamWriter) gets the observer events too.
+
+    record_meta stores each directory's mtime, device and inode in the tree
+    (one extra stat per directory) so it can be saved with save_snapshot.
+    previous, a tree from load_snapshot of the same root, makes the scan
+    incremental: folders whose mtime, device and inode are unchanged reuse
+    their previous child list instead of being listed again (implies
+    record_meta).
+
+    checkpoint is a file the scan state is saved to every checkpoint_interval
+    seconds and when the scan is canceled. A later call with
+    resume=load_checkpoint(checkpoint) continues where it stopped (same root;
+    order and engine come from the checkpoint, and previous must be the same
+    snapshot as before). The caller deletes the file once the output is saved.
+
+    dir_fds opens each folder relative to its parent's open fd instead of by
+    full path (ignored where DIR_FD_SUPPORTED is false, i.e. Windows). That
+    saves a full path lookup per folder, which pays off on deep trees on
+    network/FUSE mounts that revalidate every path component, and keeps the
+    walk consistent if a folder above is renamed during the scan. On a local
+    filesystem with a warm dentry cache the extra open/close per folder makes
+    it slightly slower, so it is off by default.
+
+    latency, a DirLatency, times every directory listing (and is notified as
+    an observer, for the scan's elapsed time); see DirLatency.write_report.
+
+    With keep_skipped=False the skips are only reported to observers (e.g. a
+    ScanLogWriter) and the returned list stays empty, so a share with a huge
+    number of unreadable folders does not hold them all in memory.
+
+    A folder whose listing fails with ENOENT or WinError 3 is often a sync
+    client placeholder being materialized or renamed, so it is listed again up
+    to `retries` times with exponential backoff (RETRY_DELAY doubling up to
+    RETRY_MAX_DELAY), while the scan carries on with other folders; only if it
+    still fails is it skipped. Folders deleted during the scan therefore cost
+    a few seconds at the end of it. retries=0 skips them right away.
+    """
+    if resume is not None:
+        if Path(resume["root"]) != root:
+            raise ValueError(f"checkpoint is of {resume['root']}, not {root}")
+        order = resume["order"]
+        record_meta = "mtimes" in resume["tree"]
+        # The thread pool and the sequential walk keep different state
+        workers = max(workers, 2) if resume["engine"] == "parallel" else 1
+        scanned_at_ns = resume["scanned_at_ns"]
+    else:
+        scanned_at_ns = time.time_ns()
+    if order not in ("dfs", "bfs"):
+        raise ValueError(f"order must be 'dfs' or 'bfs', not {order!r}")
+    depth_first = order == "dfs"
+    # Computed once; every folder below inherits the prefix through its path
+    root_lp = str(to_long_path(root, use_long_paths))
+    if previous is not None:
+        record_meta = True
+        if previous.names[0] != root.name:
+            raise ValueError(f"snapshot is of {previous.names[0]!r}, not {root.name!r}")
+    dir_fds = dir_fds and DIR_FD_SUPPORTED
+    checkpointer = None
+    if checkpoint is not None:
+        checkpointer = _Checkpointer(checkpoint, root, order, scanned_at_ns, checkpoint_interval)
+
+    if latency is not None:
+        observers = [*observers, latency]
+    if isinstance(sink, ScanObserver):
+        observers = [*observers, sink]
+    retry = _RetryQueue(retries) if retries > 0 else None
+    # Retries are picked up when poll() reads the clock
+    progress = _ProgressDispatcher(observers, keep_polling=checkpointer is not None or retry is not None)
+    for o in progress.observers:
+        o.on_progress(1, root.name, 0.0)
+    options = dict(sink=sink, previous=previous, record_meta=record_meta, checkpoint=checkpointer, resume=resume,
+                   dir_fds=dir_fds, latency=latency, keep_skipped=keep_skipped, retry=retry)
+    if workers > 1:
+        tree, skipped = _scan_parallel(root, root_lp, workers, depth_first, cancel_state, progress, **options)
+    else:
+        tree, skipped = _scan_sequential(root, root_lp, depth_first, cancel_state, progress, **options)
+    tree.scanned_at_ns = scanned_at_ns
+    progress.finish(len(tree), len(skipped) if keep_skipped else progress.skipped, cancel_state["cancel"])
+    return tree, skipped
+
+
+def scan_folders_with_progress(root: Path, use_long_paths: bool, progress_win, lbl_count, lbl_path, cancel_state, **kwargs) -> Tuple[FolderTree, List[Tuple[str, str]]]:
+    """Scan folders recursively while updating a small progress window. Supports Cancel.
+
+    The scan runs on a background thread while this (Tk) thread runs a nested
+    event loop, so the window keeps repainting and Cancel takes effect right
+    away. Takes the same keyword arguments as scan_folders; extra observers are
+    notified alongside the progress window (on the scan thread).
+    """
+    tk_progress = TkProgress(progress_win, lbl_count, lbl_path)
+    observers = [tk_progress] + list(kwargs.pop("observers", ()))
+    result = {}
+
+    def run() -> None:
         try:
-            # Use long path where applicable
-            scan_target = to_long_path(dir_path, use_long_paths)
-            with os.scandir(str(scan_target)) as it:
-                for entry in it:
-                    if cancel_state["cancel"]:
-                        return
-                    try:
-                        if not entry.is_dir(follow_symlinks=False):
-                            continue
-                    except OSError as e:
-                        # If WinError 3, log explicitly
-                        if hasattr(e, "winerror") and e.winerror == 3:
-                            skipped.append((entry.path, "WinError 3 (path not found) - likely placeholder/online-only or moved"))
-                        else:
-                            skipped.append((entry.path, f"is_dir failed: {e}"))
-                        continue
+            result["value"] = scan_folders(root, use_long_paths, cancel_state, observers, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+            tk_progress.events.put((0, None))
 
-                    name = entry.name
-                    row = ancestors + [name]
-                    rows.append(row)
-                    found += 1
-
-                    now = time.time()
-                    if now - last_update > 0.05:
-                        lbl_count.config(text=f"Folders found: {found}")
-                        lbl_path.config(text=f"Current: {'/'.join(row[-4:])}")
-                        progress_win.update_idletasks()
-                        last_update = now
-
-                    try:
-                        walk_dir(Path(entry.path), row)
-                    except RecursionError as e:
-                        skipped.append((entry.path, f"recursion error: {e}"))
-        except OSError as e:
-            # Catch directory-level failures
-            if hasattr(e, "winerror") and e.winerror == 3:
-                skipped.append((str(dir_path), "WinError 3 (path not found) - likely placeholder/online-only or moved"))
-            elif e.errno == errno.ENOENT:
-                skipped.append((str(dir_path), "ENOENT (no such file or directory)"))
-            elif e.errno == errno.EACCES:
-                skipped.append((str(dir_path), "EACCES (permission denied)"))
-            else:
-                skipped.append((str(dir_path), f"os error: {e}"))
+    def poll() -> None:
+        if tk_progress.poll() and not worker.is_alive():
+            progress_win.quit()
+        else:
+            progress_win.after(int(PROGRESS_INTERVAL * 1000), poll)
 
-    walk_dir(root_lp, [root.name])
-    return rows, skipped
+    worker = threading.Thread(target=run, name="folder-scan", daemon=True)
+    worker.start()
+    progress_win.after(int(PROGRESS_INTERVAL * 1000), poll)
+    progress_win.mainloop()
+    worker.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
 
 
-def main():
+WATCH_SETTLE = 2.0
+WATCH_RESCAN_INTERVAL = 300.0
+
+
+class _Inotify:
+    """Minimal Linux inotify binding over ctypes (directory events only)."""
+
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    # Only changes to a directory's list of entries matter here
+    MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW
+
+    def __init__(self):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._ctypes = ctypes
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            err = self._ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[Tuple[int, int]]:
+        """(wd, mask) for the events available within timeout seconds."""
+        import select
+        import struct
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        buf = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, name_len = struct.unpack_from("iIII", buf, offset)
+            events.append((wd, mask))
+            offset += 16 + name_len
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _SkipRecords(ScanObserver):
+    def __init__(self):
+        self.records: List[Tuple[str, str, str, Optional[int], Optional[int], int]] = []
+
+    def on_skip_detail(self, path: str, reason: str, category: str, errno_code: Optional[int], winerror: Optional[int], depth: int) -> None:
+        self.records.append((path, reason, category, errno_code, winerror, depth))
+
+
+class FolderWatcher:
+    """Keeps the tree of a finished scan up to date until canceled.
+
+    On Linux every folder gets an inotify watch; when subfolders are created,
+    deleted or renamed, the folders that saw events are listed again and the
+    rest of the tree is reused as is (FolderTree.clean), so an update costs no
+    I/O outside the changed folders. Folders that could not be watched (the
+    fs.inotify.max_user_watches limit, permissions, or no inotify at all) are
+    covered by an mtime-based incremental rescan every rescan_interval seconds.
+
+    tree must come from a record_meta scan of root. skipped holds the last
+    rescan's skips as (path, reason, category, errno, winerror, depth), the
+    arguments of ScanObserver.on_skip_detail (see write_scan_log).
+    """
+
+    def __init__(self, root: Path, tree: FolderTree, use_long_paths: bool = False, workers: int = 1, order: str = "dfs",
+                 settle: float = WATCH_SETTLE, rescan_interval: float = WATCH_RESCAN_INTERVAL):
+        if tree.inodes is None:
+            raise ValueError("FolderWatcher needs a tree scanned with record_meta")
+        self.root = root
+        self.tree = tree
+        self.skipped: List[Tuple[str, str, str, Optional[int], Optional[int], int]] = []
+        self.use_long_paths = use_long_paths
+        self.workers = workers
+        self.order = order
+        self.settle = settle
+        self.rescan_interval = rescan_interval
+        self.limit_hit = False
+        # inotify gives one watch descriptor per directory (device, inode)
+        self._wd_by_id: Dict[Tuple[int, int], int] = {}
+        self._node_of_wd: Dict[int, int] = {}
+        self._dirty = set()
+        self._overflow = False
+        try:
+            self._inotify = _Inotify() if sys.platform.startswith("linux") else None
+        except (OSError, AttributeError):
+            self._inotify = None
+        self._update_watches(range(len(tree)))
+
+    @property
+    def watched(self) -> int:
+        return len(self._node_of_wd)
+
+    def _update_watches(self, candidates: Iterable[int]) -> None:
+        tree = self.tree
+        old_wds = self._wd_by_id
+        self._wd_by_id = {}
+        self._node_of_wd = {}
+        added = []
+        if self._inotify is None:
+            return
+        root_s = str(self.root)
+        for node in candidates:
+            file_id = tree.file_id(node)
+            if file_id is None:
+                continue
+            wd = old_wds.pop(file_id, None)
+            if wd is None:
+                if self.limit_hit:
+                    continue
+                try:
+                    wd = self._inotify.add_watch(os.path.join(root_s, *tree.row(node)[1:]))
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        self.limit_hit = True
+                    continue
+                added.append(wd)
+            self._wd_by_id[file_id] = wd
+            self._node_of_wd[wd] = node
+        # Folders that left the tree (moved elsewhere) no longer need a watch
+        for wd in old_wds.values():
+            self._inotify.rm_watch(wd)
+        # A subfolder created between listing a new folder and watching it
+        # raised no event, so new folders get one more mtime check
+        self._dirty.update(added)
+
+    def _rescan(self, cancel_state) -> bool:
+        tree = self.tree
+        clean = bytearray(len(tree))
+        if not self._overflow:
+            for wd, node in self._node_of_wd.items():
+                if wd not in self._dirty:
+                    clean[node] = 1
+        self._dirty.clear()
+        self._overflow = False
+        tree.clean = clean
+        skips = _SkipRecords()
+        try:
+            new_tree, _ = scan_folders(self.root, self.use_long_paths, cancel_state, [skips], workers=self.workers,
+                                       order=self.order, previous=tree, keep_skipped=False)
+        finally:
+            tree.clean = None
+        # Listing order varies with workers > 1
+        skipped = sorted(skips.records)
+        if cancel_state["cancel"]:
+            return False
+        changed = new_tree.names != tree.names or new_tree.parents != tree.parents or skipped != self.skipped
+        self.tree, self.skipped = new_tree, skipped
+        # Reuse watches by (device, inode), so renamed/moved folders keep theirs
+        self._update_watches(range(len(new_tree)))
+        return changed
+
+    def run(self, cancel_state, on_update) -> None:
+        """Block until cancel_state["cancel"] is set, calling on_update(tree,
+        skipped) whenever the folder structure or the skips change."""
+        unwatched_rescan = time.monotonic() + self.rescan_interval
+        last_event = None
+        try:
+            while not cancel_state["cancel"]:
+                if self._inotify is not None:
+                    events = self._inotify.read(0.5)
+                else:
+                    events = []
+                    time.sleep(0.5)
+                now = time.monotonic()
+                for wd, mask in events:
+                    if mask & _Inotify.IN_Q_OVERFLOW:
+                        self._overflow = True
+                    elif mask & _Inotify.IN_IGNORED:
+                        # The folder is gone; its parent's event covers the change
+                        node = self._node_of_wd.pop(wd, None)
+                        if node is not None:
+                            self._wd_by_id.pop(self.tree.file_id(node), None)
+                    elif mask & _Inotify.IN_ISDIR:
+                        self._dirty.add(wd)
+                    else:
+                        continue
+                    last_event = now
+                if self._dirty and last_event is None:
+                    last_event = now
+                settled = last_event is not None and now - last_event >= self.settle
+                unwatched = self.watched < len(self.tree)
+                if settled or (unwatched and now >= unwatched_rescan):
+                    last_event = None
+                    if unwatched:
+                        unwatched_rescan = now + self.rescan_interval
+                    if self._rescan(cancel_state):
+                        on_update(self.tree, self.skipped)
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+
+def main(profile_memory: bool = False, latency_report: bool = False):
+    """GUI entry point. profile_memory, latency_report: see cli_main's
+    --profile-memory and --latency-report."""
+    try:
+        import tkinter as tk
+        from tkinter import filedialog, messagebox
+    except Exception as e:
+        print("tkinter is required for the GUI. Install it or run on a system with tkinter available.", file=sys.stderr)
+        print("For a headless run use: python dropbox_folders.py ROOT [-o OUTPUT]", file=sys.stderr)
+        raise
+
     root = tk.Tk()
     root.withdraw()
 
@@ -224,21 +2474,41 @@ def main():
 
     # Ask for save location BEFORE scanning
     default_xlsx = base.name + "_folders.xlsx"
-    default_csv = base.name + "_folders.csv"
-    want_xlsx = HAVE_OPENPYXL
 
     out_name = filedialog.asksaveasfilename(
         title="Save output as",
         initialdir=base.parent.as_posix(),
-        initialfile=default_xlsx if want_xlsx else default_csv,
-        defaultextension=".xlsx" if want_xlsx else ".csv",
-        filetypes=[("Excel Workbook", "*.xlsx"), ("CSV (Comma delimited)", "*.csv"), ("All files", "*.*")],
+        initialfile=default_xlsx,
+        defaultextension=".xlsx",
+        filetypes=[("Excel Workbook", "*.xlsx"), ("CSV (Comma delimited)", "*.csv"),
+                   ("Compressed CSV", "*.csv.gz *.csv.xz *.csv.zst"),
+                   ("SQLite database", "*.db *.sqlite *.sqlite3"), ("JSON Lines", "*.jsonl"),
+                   ("Parquet (needs pyarrow)", "*.parquet"),
+                   ("All files", "*.*")],
     )
     if not out_name:
         messagebox.showwarning("Canceled", "No output file chosen.")
         return
 
-    out_path = Path(out_name)
+    fmt, out_path = output_target(Path(out_name))
+    problem = missing_dependency(fmt, out_path)
+    if problem:
+        messagebox.showerror("Error", problem)
+        return
+
+    # Offer to continue a scan of this output that was canceled or interrupted
+    checkpoint_path = checkpoint_path_for(out_path)
+    resume = None
+    if checkpoint_path.exists():
+        try:
+            resume = load_checkpoint(checkpoint_path)
+        except Exception:
+            resume = None
+        if resume is not None and Path(resume["root"]) != base:
+            resume = None
+        if resume is not None and not messagebox.askyesno(
+                "Resume", "An earlier scan of this folder to this file did not finish.\n\nContinue where it stopped?"):
+            resume = None
 
     # Small options dialog for Windows long paths
     use_long_paths = True if IS_WINDOWS else False
@@ -271,11 +2541,53 @@ def main():
 
     btn_cancel = tk.Button(progress, text="Cancel", command=do_cancel)
     btn_cancel.pack(pady=10)
+    progress.protocol("WM_DELETE_WINDOW", do_cancel)
 
     progress.update_idletasks()
 
+    # CSV/SQLite/JSONL are streamed to disk while scanning; Excel/Parquet are written afterwards.
+    latency = DirLatency() if latency_report else None
+    profiler = None
+    if profile_memory:
+        profiler = MemoryProfiler()
+        profiler.start()
+    try:
+        stream = stream_writer(out_path, fmt)
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to save output:\n{e}")
+        raise
+
+    # Skips are logged as they are found (a resumed scan adds to its log)
+    log_path = out_path.with_suffix(".scan_log.jsonl")
+    try:
+        scan_log = ScanLogWriter(log_path, append=resume is not None)
+    except Exception as e:
+        messagebox.showwarning("Log", f"Could not write log file:\n{e}")
+        scan_log = None
+        log_path = None
+
     # Scan with UI
-    rows, skipped = scan_folders_with_progress(base, use_long_paths, progress, lbl_count, lbl_path, cancel_state)
+    try:
+        tree, skipped = scan_folders_with_progress(base, use_long_paths, progress, lbl_count, lbl_path, cancel_state,
+                                                   observers=[scan_log] if scan_log is not None else [],
+                                                   workers=DEFAULT_SCAN_WORKERS, sink=stream,
+                                                   checkpoint=checkpoint_path, resume=resume, latency=latency,
+                                                   keep_skipped=scan_log is None)
+    except BaseException:
+        if stream is not None:
+            stream.discard()
+        raise
+    finally:
+        if scan_log is not None:
+            scan_log.close()
+    skipped_count = scan_log.skipped if scan_log is not None else len(skipped)
+    if scan_log is not None and scan_log.error is not None:
+        messagebox.showwarning("Log", f"Could not write log file:\n{scan_log.error}")
+        log_path = None
+    skipped = None
+    resumed, resume = resume is not None, None
+    if profiler is not None:
+        profiler.phase("scan")
 
     # Close progress window
     try:
@@ -283,43 +2595,330 @@ def main():
     except Exception:
         pass
 
-    if cancel_state["cancel"] and len(rows) <= 1:
+    if cancel_state["cancel"] and len(tree) <= 1:
+        if profiler is not None:
+            profiler.stop()
+        if stream is not None:
+            stream.discard()
+        if log_path is not None and not resumed:
+            log_path.unlink()
         messagebox.showinfo("Canceled", "Scan canceled. No data saved.")
         return
 
     # Save data
     try:
-        if out_path.suffix.lower() == ".xlsx" and HAVE_OPENPYXL:
-            write_excel(rows, out_path)
-            saved_path = out_path
+        if stream is None:
+            write_output(tree, out_path, fmt, on_phase=profiler.phase if profiler is not None else None)
         else:
-            csv_path = out_path if out_path.suffix.lower() == ".csv" else out_path.with_suffix(".csv")
-            write_csv(rows, csv_path)
-            saved_path = csv_path
+            stream.close(tree)
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save output:\n{e}")
         raise
+    if not cancel_state["cancel"]:
+        try:
+            checkpoint_path.unlink()
+        except FileNotFoundError:
+            pass
 
-    # Save log
-    log_path = saved_path.with_suffix(".scan_log.txt")
-    try:
-        save_log(skipped, log_path)
-    except Exception as e:
-        messagebox.showwarning("Log", f"Could not write log file:\n{e}")
-        log_path = None
+    latency_path = None
+    if latency is not None:
+        latency_path = out_path.with_suffix(".latency.txt")
+        try:
+            latency.write_report(latency_path, DEFAULT_SCAN_WORKERS)
+        except Exception as e:
+            messagebox.showwarning("Latency report", f"Could not write latency report:\n{e}")
+            latency_path = None
+
+    profile_path = None
+    if profiler is not None:
+        profiler.phase("save")
+        profiler.stop()
+        profile_path = out_path.with_suffix(".memory_profile.txt")
+        try:
+            profiler.write_report(profile_path)
+        except Exception as e:
+            messagebox.showwarning("Memory profile", f"Could not write memory profile:\n{e}")
+            profile_path = None
 
     # Summary
-    found_count = len(rows)
-    skipped_count = len(skipped)
-    msg = f"Saved {saved_path}\n\nFolders found: {found_count}\nSkipped: {skipped_count}"
+    found_count = len(tree)
+    msg = f"Saved {out_path}\n\nFolders found: {found_count}\nSkipped: {skipped_count}"
     if log_path:
         msg += f"\nLog: {log_path}"
+    if latency_path:
+        msg += f"\nLatency report: {latency_path}"
+    if profile_path:
+        msg += f"\nMemory profile: {profile_path}"
     if skipped_count > 0:
         msg += "\nCommon reasons: online-only placeholders, moved/renamed during scan, or long-path/permission limits."
     if cancel_state["cancel"]:
         msg += "\nNote: Scan was canceled early; results are partial."
+        msg += "\nPick the same folder and output file again to continue it."
     messagebox.showinfo("Done", msg)
 
 
+def cli_main(argv: Optional[List[str]] = None) -> int:
+    """Headless entry point: scan, export and write the scan log without tkinter."""
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(
+        description="Export every subfolder of ROOT (folder names only) to .xlsx or .csv, without the GUI.")
+    parser.add_argument("root", help="folder to scan")
+    parser.add_argument("-o", "--output",
+                        help="output file (default: <root name>_folders.<format> in the current directory; "
+                             "- writes JSON Lines to stdout)")
+    parser.add_argument("-f", "--format", choices=("xlsx", "csv", "sqlite", "parquet", "jsonl"),
+                        help="output format (default: from the output suffix: .csv, .db/.sqlite/.sqlite3, "
+                             ".parquet, .jsonl, .xlsx; otherwise CSV, written as <name>.csv)")
+    parser.add_argument("--long-paths", dest="long_paths", action="store_true", default=IS_WINDOWS,
+                        help="use the Windows extended-length path prefix (\\\\?\\); default on Windows")
+    parser.add_argument("--no-long-paths", dest="long_paths", action="store_false")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_SCAN_WORKERS,
+                        help=f"directory-listing threads (default: {DEFAULT_SCAN_WORKERS}; 1 = sequential walk)")
+    parser.add_argument("--order", choices=("dfs", "bfs"), default="dfs", help="row order (default: dfs)")
+    parser.add_argument("--dir-fds", action="store_true",
+                        help="open each folder relative to its parent (openat) instead of by full path; faster on "
+                             "deep trees on network/FUSE mounts, and safe against renames mid-scan (not on Windows)")
+    parser.add_argument("--retries", type=int, default=RETRY_ATTEMPTS, metavar="N",
+                        help=f"list a folder that fails with ENOENT/WinError 3 (e.g. a placeholder being "
+                             f"materialized) up to N more times, with backoff, before skipping it "
+                             f"(default: {RETRY_ATTEMPTS}; 0 = skip right away)")
+    parser.add_argument("--split-by-top-level", action="store_true",
+                        help="xlsx: start a new sheet rather than split a top-level folder's subtree")
+    parser.add_argument("--excel-engine", choices=("native", "openpyxl"), default="native")
+    parser.add_argument("--sqlite-closure", action="store_true",
+                        help="sqlite: also build the folder_closure (ancestor, descendant) table")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="incremental rescans: reuse unchanged folders from this snapshot of a previous "
+                             "scan of the same root, then update it (created if missing)")
+    parser.add_argument("--diff", metavar="FILE",
+                        help="with --snapshot: write the folders added, removed, renamed or moved since the "
+                             "snapshot was taken to FILE (csv)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue a canceled or interrupted scan from its checkpoint")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="checkpoint file (default: <output>.checkpoint.json.gz; removed once the output is saved)")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help=f"seconds between checkpoints (default: {CHECKPOINT_INTERVAL:g}; 0 = no checkpoints)")
+    parser.add_argument("--watch", action="store_true",
+                        help="after the scan, keep running and update the output (and snapshot) whenever "
+                             "subfolders change, until Ctrl+C (inotify on Linux, periodic rescans elsewhere)")
+    parser.add_argument("--rescan-interval", type=float, default=WATCH_RESCAN_INTERVAL, metavar="SECONDS",
+                        help=f"--watch: seconds between rescans of folders without an inotify watch "
+                             f"(default: {WATCH_RESCAN_INTERVAL:g})")
+    parser.add_argument("--log", metavar="FILE",
+                        help="log of skipped folders, written as they are found (default: <output>.scan_log.jsonl; "
+                             "a .csv name writes CSV)")
+    parser.add_argument("--latency-report", action="store_true",
+                        help="time every directory listing and write a latency histogram and the slowest "
+                             "folders next to the scan log")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="trace Python allocations (much slower) and write the peak and top allocation sites "
+                             "of each phase (scan, export) next to the scan log")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args(argv)
+
+    base = Path(args.root).resolve()
+    if not base.is_dir():
+        parser.error(f"not a folder: {args.root}")
+    to_stdout = args.output == "-"
+    out_path = Path(args.output) if args.output and not to_stdout else None
+    if args.format:
+        fmt = args.format
+    elif to_stdout:
+        fmt = "jsonl"
+    elif out_path is not None:
+        fmt, out_path = output_target(out_path)
+    else:
+        fmt = "xlsx"
+    if to_stdout and fmt != "jsonl":
+        parser.error("only jsonl output can go to stdout")
+    if to_stdout and args.watch:
+        parser.error("--watch needs an output file")
+    # With stdout output the log and checkpoint still go next to the default name
+    if out_path is None:
+        out_path = Path(f"{base.name}_folders{FORMAT_SUFFIXES[fmt]}")
+    problem = missing_dependency(fmt, None if to_stdout else out_path)
+    if problem:
+        parser.error(problem)
+    checkpoint_path = Path(args.checkpoint) if args.checkpoint else checkpoint_path_for(out_path)
+    resume = None
+    if args.resume:
+        if not checkpoint_path.exists():
+            parser.error(f"no checkpoint to resume: {checkpoint_path}")
+        resume = load_checkpoint(checkpoint_path)
+        if Path(resume["root"]) != base:
+            parser.error(f"checkpoint {checkpoint_path} is of {resume['root']}, not {base}")
+    if args.checkpoint_interval <= 0:
+        checkpoint_path = None
+
+    # Ctrl+C behaves like the Cancel button: stop scanning, keep partial results
+    cancel_state = {"cancel": False}
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_state.update(cancel=True))
+
+    log_path = Path(args.log) if args.log else out_path.with_suffix(".scan_log.jsonl")
+    scan_log = ScanLogWriter(log_path, append=resume is not None)
+    metrics = ScanMetrics()
+    observers: List[ScanObserver] = [metrics, scan_log]
+    latency = DirLatency() if args.latency_report else None
+    if not args.quiet and sys.stderr.isatty():
+        observers.append(ConsoleProgress())
+
+    previous = None
+    snapshot_path = Path(args.snapshot) if args.snapshot else None
+    if args.diff and snapshot_path is None:
+        parser.error("--diff needs --snapshot")
+    if snapshot_path is not None and snapshot_path.exists():
+        snap_root, previous = load_snapshot(snapshot_path)
+        if Path(snap_root) != base:
+            print(f"Snapshot {snapshot_path} is of {snap_root}, not {base}; doing a full scan.", file=sys.stderr)
+            previous = None
+
+    profiler = None
+    if args.profile_memory:
+        profiler = MemoryProfiler()
+        profiler.start()
+    stream = JsonlStreamWriter(out_path, sys.stdout, cancel_state) if to_stdout else stream_writer(out_path, fmt, args.sqlite_closure)
+    try:
+        tree, _ = scan_folders(base, args.long_paths, cancel_state, observers,
+                               workers=args.workers, order=args.order, sink=stream,
+                               previous=previous, record_meta=snapshot_path is not None or args.watch,
+                               checkpoint=checkpoint_path, checkpoint_interval=args.checkpoint_interval,
+                               resume=resume, dir_fds=args.dir_fds, latency=latency, keep_skipped=False,
+                               retries=args.retries)
+    except BaseException:
+        # No half-written .part files left behind
+        if stream is not None:
+            stream.discard()
+        raise
+    finally:
+        scan_log.close()
+    if scan_log.error is not None:
+        print(f"Warning: could not write log file {log_path}: {scan_log.error}", file=sys.stderr)
+    resumed, resume = resume is not None, None
+    broken = to_stdout and stream.broken
+    if broken:
+        # The reader of stdout went away (e.g. | head) and the scan stopped;
+        # point stdout at devnull so the exit flush cannot fail too. A stream
+        # to stdout cannot be resumed, so the cancel checkpoint goes.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        if checkpoint_path is not None:
+            try:
+                checkpoint_path.unlink()
+            except FileNotFoundError:
+                pass
+            checkpoint_path = None
+    if profiler is not None:
+        profiler.phase("scan")
+    diff_count = None
+    if args.diff and previous is not None and not cancel_state["cancel"]:
+        diff_count = write_diff_csv(diff_trees(previous, tree), Path(args.diff))
+        if profiler is not None:
+            profiler.phase("diff")
+    previous = None
+
+    if cancel_state["cancel"] and len(tree) <= 1:
+        if profiler is not None:
+            profiler.stop()
+        if stream is not None:
+            stream.discard()
+        if not resumed:
+            log_path.unlink()
+        if broken:
+            # Exit status of a process killed by SIGPIPE, as other pipe tools report
+            return 141
+        print("Scan canceled. No data saved.", file=sys.stderr)
+        if checkpoint_path is not None:
+            print(f"Checkpoint: {checkpoint_path} (continue with --resume)", file=sys.stderr)
+        return 130
+
+    if stream is None:
+        write_output(tree, out_path, fmt, args.split_by_top_level, args.excel_engine,
+                     on_phase=profiler.phase if profiler is not None else None)
+    else:
+        stream.close(tree)
+    latency_path = None
+    if latency is not None:
+        latency_path = out_path.with_suffix(".latency.txt")
+        latency.write_report(latency_path, args.workers)
+    profile_path = None
+    if profiler is not None:
+        profiler.phase("save")
+        profiler.stop()
+        profile_path = out_path.with_suffix(".memory_profile.txt")
+        profiler.write_report(profile_path)
+    # A canceled scan is incomplete, so it would make a misleading baseline
+    if snapshot_path is not None and not cancel_state["cancel"]:
+        save_snapshot(tree, base, snapshot_path)
+    if checkpoint_path is not None and not cancel_state["cancel"]:
+        try:
+            checkpoint_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    if not args.quiet:
+        print(f"Saved {'stdout' if to_stdout else out_path}\nFolders found: {len(tree)} in {metrics.elapsed:.1f}s ({metrics.rate:,.0f}/s)"
+              f"\nSkipped: {scan_log.skipped}\nLog: {log_path}", file=sys.stderr)
+        if latency_path is not None:
+            print(f"Latency report: {latency_path}", file=sys.stderr)
+        if profile_path is not None:
+            print(f"Memory profile: {profile_path}", file=sys.stderr)
+        if cancel_state["cancel"]:
+            if broken:
+                print("Note: stdout was closed by its reader; the scan stopped early.", file=sys.stderr)
+            else:
+                print("Note: Scan was canceled early; results are partial.", file=sys.stderr)
+            if checkpoint_path is not None:
+                print(f"Checkpoint: {checkpoint_path} (continue with --resume)", file=sys.stderr)
+        elif tree.reused_dirs:
+            print(f"Unchanged folders reused from snapshot: {tree.reused_dirs}", file=sys.stderr)
+        if diff_count is not None:
+            print(f"Changes since snapshot: {diff_count} ({args.diff})", file=sys.stderr)
+        elif args.diff:
+            print("No diff written: the scan was canceled or there was no snapshot to compare with.", file=sys.stderr)
+    if cancel_state["cancel"]:
+        return 141 if broken else 130
+    if args.watch:
+        _watch_folders(base, tree, out_path, fmt, log_path, snapshot_path, args, cancel_state)
+    return 0
+
+
+def _watch_folders(base: Path, tree: FolderTree, out_path: Path, fmt: str, log_path: Path, snapshot_path: Optional[Path], args, cancel_state) -> None:
+    """cli_main --watch: rewrite the output, log and snapshot after each change."""
+    watcher = FolderWatcher(base, tree, args.long_paths, workers=args.workers, order=args.order,
+                            rescan_interval=args.rescan_interval)
+    tree = None
+    if not args.quiet:
+        print(f"Watching {watcher.watched} of {len(watcher.tree)} folders (Ctrl+C to stop)", file=sys.stderr)
+        if watcher.watched < len(watcher.tree):
+            reason = "inotify watch limit reached" if watcher.limit_hit else "not all folders can be watched"
+            print(f"Note: {reason}; the rest are rescanned every {args.rescan_interval:g}s "
+                  f"(raise fs.inotify.max_user_watches to watch more)", file=sys.stderr)
+
+    def on_update(tree: FolderTree, skipped: List[Tuple[str, str, str, Optional[int], Optional[int], int]]) -> None:
+        # Written next to the output and renamed over it, so readers never see half a file
+        tmp_path = out_path.with_name(out_path.stem + ".tmp" + out_path.suffix)
+        write_output(tree, tmp_path, fmt, args.split_by_top_level, args.excel_engine, args.sqlite_closure)
+        os.replace(tmp_path, out_path)
+        tmp_log = log_path.with_name(log_path.stem + ".tmp" + log_path.suffix)
+        write_scan_log(skipped, tmp_log, len(tree))
+        os.replace(tmp_log, log_path)
+        if snapshot_path is not None:
+            save_snapshot(tree, base, snapshot_path)
+        if not args.quiet:
+            print(f"{time.strftime('%H:%M:%S')} updated {out_path}: {len(tree)} folders, {len(skipped)} skipped",
+                  file=sys.stderr)
+
+    watcher.run(cancel_state, on_update)
+
+
 if __name__ == "__main__":
-    main()
+    # Only --profile-memory/--latency-report still run the GUI; anything else is the CLI
+    gui_flags = {"--profile-memory", "--latency-report"}
+    if sys.argv[1:] and set(sys.argv[1:]) <= gui_flags:
+        main(profile_memory="--profile-memory" in sys.argv, latency_report="--latency-report" in sys.argv)
+    elif len(sys.argv) > 1:
+        sys.exit(cli_main())
+    else:
+        main()
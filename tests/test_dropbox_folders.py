@@ -0,0 +1,160 @@
+import errno
+import gzip
+import os
+import random
+
+import pytest
+
+import dropbox_folders as d
+
+
+@pytest.fixture
+def folder_tree(tmp_path):
+    """A random 300-folder tree; returns (root, every folder path)."""
+    rng = random.Random(1)
+    root = tmp_path / "root"
+    root.mkdir()
+    dirs = [str(root)]
+    for i in range(300):
+        path = os.path.join(rng.choice(dirs), f"d{i}")
+        os.mkdir(path)
+        dirs.append(path)
+    return root, dirs
+
+
+def fail_listing(monkeypatch, failures):
+    """Make os.scandir raise for the paths in failures, a dict of path ->
+    (exception, how many times; -1 for always)."""
+    real = os.scandir
+
+    def scandir(path="."):
+        exc, left = failures.get(str(path), (None, 0))
+        if left:
+            failures[str(path)] = (exc, left - 1)
+            raise exc
+        return real(path)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+
+
+def reachable(dirs, unlisted):
+    """Folders found when the unlisted ones cannot be listed: they are still
+    rows, their subfolders are not."""
+    return [p for p in dirs if not any(p.startswith(u + os.sep) for u in unlisted)]
+
+
+def scan(root, **kwargs):
+    return d.scan_folders(root, False, {"cancel": False}, **kwargs)
+
+
+@pytest.mark.parametrize("order", ["dfs", "bfs"])
+def test_parallel_scan_matches_sequential(folder_tree, monkeypatch, order):
+    root, dirs = folder_tree
+    denied = random.Random(2).sample(dirs[1:], 10)
+    fail_listing(monkeypatch, {p: (PermissionError(errno.EACCES, "denied", p), -1) for p in denied})
+    tree, skipped = scan(root, order=order, record_meta=True)
+    assert len(tree) == len(reachable(dirs, denied))
+    assert sorted(path for path, _ in skipped) == sorted(reachable(denied, denied))
+    for workers in (2, 8):
+        other, other_skipped = scan(root, workers=workers, order=order, record_meta=True)
+        assert list(other) == list(tree)
+        assert other.parents == tree.parents
+        assert other.mtimes == tree.mtimes
+        # Skips keep their place in the walk, not the order they were hit
+        assert other_skipped == skipped
+
+
+class _CancelAfter:
+    def __init__(self, cancel_state, count):
+        self.cancel_state = cancel_state
+        self.count = count
+
+    def add(self, tree, node):
+        self.count -= 1
+        if self.count <= 0:
+            self.cancel_state["cancel"] = True
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+@pytest.mark.parametrize("order", ["dfs", "bfs"])
+def test_resume_from_checkpoint(folder_tree, tmp_path, workers, order):
+    root, _ = folder_tree
+    checkpoint = tmp_path / "scan.checkpoint.json.gz"
+    cancel_state = {"cancel": False}
+    partial, _ = d.scan_folders(root, False, cancel_state, workers=workers, order=order,
+                                sink=_CancelAfter(cancel_state, 100), checkpoint=checkpoint)
+    assert cancel_state["cancel"] and len(partial) < 301
+    resumed, _ = scan(root, workers=workers, order=order, resume=d.load_checkpoint(checkpoint))
+    full, _ = scan(root, order=order)
+    assert list(resumed) == list(full)
+    assert resumed.parents == full.parents
+
+
+def test_diff_trees(folder_tree, tmp_path):
+    root, _ = folder_tree
+    snapshot = tmp_path / "snapshot.json.gz"
+    tree, _ = scan(root, record_meta=True)
+    d.save_snapshot(tree, root, snapshot)
+    _, previous = d.load_snapshot(snapshot)
+
+    rescan, _ = scan(root, previous=previous)
+    assert list(d.diff_trees(previous, rescan)) == []
+
+    top = sorted(p.name for p in root.iterdir())
+    (root / top[0]).rename(root / "renamed")
+    (root / top[1]).rename(root / top[2] / "moved")
+    (root / "new").mkdir()
+    removed = next(p for p in (root / top[3]).rglob("*") if not any(p.iterdir()))
+    removed.rmdir()
+    rescan, _ = scan(root, previous=previous)
+    assert sorted(d.diff_trees(previous, rescan)) == sorted([
+        ("renamed", "root/renamed", f"root/{top[0]}"),
+        ("moved", f"root/{top[2]}/moved", f"root/{top[1]}"),
+        ("added", "root/new", ""),
+        ("removed", "", "/".join(("root",) + removed.relative_to(root).parts)),
+    ])
+
+
+def test_diff_trees_tells_devices_apart():
+    old = d.FolderTree("root", with_meta=True)
+    old.set_meta(old.add(0, "a"), 1, 10, 5)
+    old.set_meta(old.add(0, "b"), 1, 20, 6)
+    new = d.FolderTree("root", with_meta=True)
+    new.set_meta(new.add(0, "a"), 1, 10, 5)
+    # Same inode as b, on another device: a different folder
+    new.set_meta(new.add(0, "c"), 1, 30, 6)
+    assert list(d.diff_trees(old, new)) == [("added", "root/c", ""), ("removed", "", "root/b")]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_retry_vanished_folder(folder_tree, monkeypatch, workers):
+    root, dirs = folder_tree
+    flaky, gone = dirs[5], dirs[9]
+    fail_listing(monkeypatch, {
+        flaky: (FileNotFoundError(errno.ENOENT, "gone", flaky), 1),
+        gone: (FileNotFoundError(errno.ENOENT, "gone", gone), -1),
+    })
+    tree, skipped = scan(root, workers=workers, retries=1)
+    assert len(tree) == len(reachable(dirs, [gone]))
+    assert [path for path, _ in skipped] == [gone]
+    assert "after 1 retries" in skipped[0][1]
+
+
+def test_retries_off_skips_right_away(folder_tree, monkeypatch):
+    root, dirs = folder_tree
+    fail_listing(monkeypatch, {dirs[5]: (FileNotFoundError(errno.ENOENT, "gone", dirs[5]), 1)})
+    _, skipped = scan(root, retries=0)
+    assert [path for path, _ in skipped] == [dirs[5]]
+
+
+@pytest.mark.parametrize("name", ["folders.csv", "folders.csv.gz"])
+def test_streamed_csv_matches_write_csv(folder_tree, tmp_path, name):
+    root, _ = folder_tree
+    stream = d.CsvStreamWriter(tmp_path / name)
+    tree, _ = scan(root, workers=8, order="bfs", sink=stream)
+    stream.close(tree)
+    d.write_csv(tree, tmp_path / ("ref_" + name))
+    read = gzip.open if name.endswith(".gz") else open
+    with read(stream.out_path, "rb") as f, read(tmp_path / ("ref_" + name), "rb") as ref:
+        assert f.read() == ref.read()
+    assert not stream.part_path.exists()